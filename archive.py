@@ -0,0 +1,70 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne
+
+from database import attendance_collection, attendance_archive_collection, for_reporting
+
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = 1000
+
+
+async def archive_paid_sessions(retention_days: int = ARCHIVE_RETENTION_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE):
+    """Move paid sessions older than the retention window into attendance_archive.
+
+    Each batch is copied with idempotent upserts before it is deleted from the hot
+    collection, so an interrupted run can simply be started again.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    moved = 0
+
+    while True:
+        batch = await attendance_collection.find(
+            {"paid": True, "check_out": {"$lt": cutoff}}
+        ).sort("check_out", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+
+        archived_at = datetime.utcnow()
+        await attendance_archive_collection.bulk_write(
+            [ReplaceOne({"_id": session["_id"]}, {**session, "archived_at": archived_at}, upsert=True)
+             for session in batch],
+            ordered=False
+        )
+        await attendance_collection.delete_many({
+            "_id": {"$in": [session["_id"] for session in batch]},
+            "paid": True
+        })
+
+        moved += len(batch)
+        print(f"📦 Archived {moved} sessions...")
+
+    print(f"✅ Archive complete: {moved} sessions older than {cutoff:%Y-%m-%d} moved")
+    return moved
+
+
+async def iter_sessions(query: dict, projection: dict = None, batch_size: int = 1000, reporting: bool = False):
+    """Yield sessions matching a query from both tiers, merged in check-in order.
+
+    ``reporting`` reads from secondaries when available.
+    """
+    collections = (attendance_collection, attendance_archive_collection)
+    if reporting:
+        collections = tuple(for_reporting(collection) for collection in collections)
+    cursors = [
+        aiter(collection.find(query, projection).sort("check_in", 1).batch_size(batch_size))
+        for collection in collections
+    ]
+    heads = [await anext(cursor, None) for cursor in cursors]
+
+    while any(head is not None for head in heads):
+        i = min(
+            (i for i, head in enumerate(heads) if head is not None),
+            key=lambda i: heads[i]["check_in"]
+        )
+        yield heads[i]
+        heads[i] = await anext(cursors[i], None)
+
+
+if __name__ == "__main__":
+    asyncio.run(archive_paid_sessions())
@@ -1,19 +1,26 @@
 import os
 import jwt
 import numpy as np
-from fastapi import HTTPException, Depends, UploadFile, Form, status
+from fastapi import HTTPException, Depends, UploadFile, File, Form, Header, status
 from fastapi.security import OAuth2PasswordBearer
 from datetime import datetime, timedelta
 from bson import ObjectId
 
-from database import employees_collection, employers_collection
-from utils import get_face_encoding, compare_faces, hash_password, verify_password
+from database import employees_collection, employers_collection, INTERACTIVE_MAX_TIME_MS
+from utils import compare_faces, hash_password, verify_password, ImageQualityError
+from face_queue import encode_upload
+from identity import lookup_identity
 
 # JWT Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "mysecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Short-lived proof that an employee just passed face login on a given device.
+# It carries its own audience, so decode_token() rejects it as an access token.
+FACE_CLAIM_AUDIENCE = "face-verified"
+FACE_CLAIM_TTL_SECONDS = int(os.getenv("FACE_CLAIM_TTL_SECONDS", "120"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
@@ -34,6 +41,33 @@ def decode_token(token: str):
         return None
 
 
+def create_face_claim(user_id: str, device_id: str):
+    """Sign a face-verified claim bound to an employee and a device."""
+    return create_access_token(
+        {"sub": user_id, "device": device_id, "aud": FACE_CLAIM_AUDIENCE},
+        timedelta(seconds=FACE_CLAIM_TTL_SECONDS)
+    )
+
+
+def verify_face_claim(token: str, user_id: str, device_id: str) -> bool:
+    """Check a face-verified claim is unexpired and was issued to this user on this device."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], audience=FACE_CLAIM_AUDIENCE)
+    except jwt.PyJWTError as e:
+        print("❌ Face claim rejected:", str(e))
+        return False
+    return payload.get("sub") == user_id and device_id is not None and payload.get("device") == device_id
+
+
+def add_face_claim(response: dict, user_id: str, issue_face_claim: bool, device_id: str):
+    """Attach a face-verified claim to an employee face-login response when the client asks for one."""
+    if not issue_face_claim:
+        return response
+    response["face_verified_token"] = create_face_claim(user_id, device_id)
+    response["face_verified_expires_in"] = FACE_CLAIM_TTL_SECONDS
+    return response
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     """Retrieve the current user from the token and fetch user details from the database."""
     payload = decode_token(token)
@@ -52,7 +86,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid user ID format")
 
     collection = employees_collection if user_type == "employee" else employers_collection
-    user = await collection.find_one({"_id": user_id})
+    user = await collection.find_one({"_id": user_id}, max_time_ms=INTERACTIVE_MAX_TIME_MS)
 
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -70,35 +104,39 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 # -------------------------------
 async def login_with_password(email: str = Form(...), password: str = Form(...)):
     """Authenticate an employer or employee using email and password."""
-    user = await employers_collection.find_one({"email": email})
-    user_type = "employer"
-
-    if not user:
-        user = await employees_collection.find_one({"email": email})
-        user_type = "employee"
+    identity = await lookup_identity(email)
 
-    if not user or not verify_password(password, user["password"]):
+    if not identity or not verify_password(password, identity["password"]):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email or password")
 
-    token = create_access_token({"sub": str(user["_id"]), "type": user_type})
+    token = create_access_token({"sub": identity["user_id"], "type": identity["user_type"]})
     return {
         "access_token": token,
         "token_type": "bearer",
-        "user_type": user_type,
-        "username": user["username"],
-        "email": user["email"]
+        "user_type": identity["user_type"],
+        "username": identity["username"],
+        "email": email
     }
 
 
 # -------------------------------
 # LOGIN with Face (General)
 # -------------------------------
-async def login_with_face(image: UploadFile):
+async def login_with_face(
+    image: UploadFile = File(None),
+    chip: UploadFile = File(None),
+    landmarks: str = Form(None),
+    issue_face_claim: bool = Form(False),
+    x_device_id: str = Header(None)
+):
     """Authenticate a user (employee or employer) using face recognition."""
-    image_bytes = await image.read()
+    if issue_face_claim and not x_device_id:
+        raise HTTPException(status_code=400, detail="X-Device-Id header is required to issue a face claim")
 
     try:
-        unknown_encoding = get_face_encoding(image_bytes)
+        unknown_encoding = await encode_upload(image, chip, landmarks)
+    except ImageQualityError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
 
@@ -114,13 +152,13 @@ async def login_with_face(image: UploadFile):
             stored_encoding = np.array(stored_encoding, dtype=np.float64)
             if compare_faces([stored_encoding], unknown_encoding):
                 token = create_access_token({"sub": str(employee["_id"]), "type": "employee"})
-                return {
+                return add_face_claim({
                     "access_token": token,
                     "token_type": "bearer",
                     "user_type": "employee",
                     "username": employee["username"],
                     "email": employee["email"]
-                }
+                }, str(employee["_id"]), issue_face_claim, x_device_id)
 
     # Try employers
     async for employer in employers_collection.find({"face_encoding": {"$exists": True}}):
@@ -143,12 +181,21 @@ async def login_with_face(image: UploadFile):
 # -------------------------------
 # LOGIN with Face (Employee Only)
 # -------------------------------
-async def login_employee_with_face(image: UploadFile):
+async def login_employee_with_face(
+    image: UploadFile = File(None),
+    chip: UploadFile = File(None),
+    landmarks: str = Form(None),
+    issue_face_claim: bool = Form(False),
+    x_device_id: str = Header(None)
+):
     """Authenticate an employee using face recognition."""
-    image_bytes = await image.read()
+    if issue_face_claim and not x_device_id:
+        raise HTTPException(status_code=400, detail="X-Device-Id header is required to issue a face claim")
 
     try:
-        unknown_encoding = get_face_encoding(image_bytes)
+        unknown_encoding = await encode_upload(image, chip, landmarks)
+    except ImageQualityError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
 
@@ -163,13 +210,13 @@ async def login_employee_with_face(image: UploadFile):
             stored_encoding = np.array(stored_encoding, dtype=np.float64)
             if compare_faces([stored_encoding], unknown_encoding):
                 token = create_access_token({"sub": str(employee["_id"]), "type": "employee"})
-                return {
+                return add_face_claim({
                     "access_token": token,
                     "token_type": "bearer",
                     "user_type": "employee",
                     "username": employee["username"],
                     "email": employee["email"]
-                }
+                }, str(employee["_id"]), issue_face_claim, x_device_id)
 
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Face not recognized")
 
@@ -177,12 +224,16 @@ async def login_employee_with_face(image: UploadFile):
 # -------------------------------
 # LOGIN with Face (Employer Only)
 # -------------------------------
-async def login_employer_with_face(image: UploadFile):
+async def login_employer_with_face(
+    image: UploadFile = File(None),
+    chip: UploadFile = File(None),
+    landmarks: str = Form(None)
+):
     """Authenticate an employer using face recognition."""
-    image_bytes = await image.read()
-
     try:
-        unknown_encoding = get_face_encoding(image_bytes)
+        unknown_encoding = await encode_upload(image, chip, landmarks)
+    except ImageQualityError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
 
@@ -0,0 +1,55 @@
+"""Measure cold import time and peak RSS of main:app for each APP_ROLE.
+
+Usage:
+    python bench_startup.py [--runs 5]
+
+Each run imports the app in a fresh interpreter, so the numbers reflect what a
+new uvicorn worker pays before it can accept requests. The "face" and "all"
+roles also warm up the face models, as the startup hook does.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROLES = ("api", "face", "all")
+
+CHILD = """
+import main
+if main.SERVES_FACE:
+    main.warm_up_face_backend()
+"""
+
+
+def measure(role: str):
+    env = {**os.environ, "APP_ROLE": role}
+    env.setdefault("MONGO_URI", "mongodb://localhost:27017")  # the client does not connect at import
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", CHILD], env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError(f"APP_ROLE={role} failed to start (status {status})")
+
+    # ru_maxrss is reported in kilobytes on Linux.
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark startup time and RSS per app role.")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'role':<6} {'startup (s)':>12} {'peak RSS (MB)':>14}")
+    for role in ROLES:
+        samples = [measure(role) for _ in range(args.runs)]
+        startup = statistics.median(elapsed for elapsed, _ in samples)
+        rss = statistics.median(rss for _, rss in samples)
+        print(f"{role:<6} {startup:>12.2f} {rss:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, ReadPreference
+from pymongo.monitoring import ConnectionPoolListener
+import argparse
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -8,23 +13,277 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "attendance_system")
 
-# Enforce TLS 1.2+ using MongoDB Atlas defaults
-client = AsyncIOMotorClient(MONGO_URI, tls=True, tlsAllowInvalidCertificates=False)
+# Connection pool sizing and deadlines; size MONGO_MAX_POOL_SIZE against uvicorn concurrency
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+
+# Server-side maxTimeMS budgets per kind of query
+INTERACTIVE_MAX_TIME_MS = int(os.getenv("INTERACTIVE_MAX_TIME_MS", "2000"))
+REPORTING_MAX_TIME_MS = int(os.getenv("REPORTING_MAX_TIME_MS", "15000"))
+
+
+class PoolStats(ConnectionPoolListener):
+    """Counts pooled connections across all servers from driver pool events."""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+
+pool_stats = PoolStats()
+
+# Enforce TLS 1.2+ using MongoDB Atlas defaults. The client only connects on first
+# use; connect_database() and close_database() bracket it in the app lifecycle.
+client = AsyncIOMotorClient(
+    MONGO_URI,
+    tls=True,
+    tlsAllowInvalidCertificates=False,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    event_listeners=[pool_stats]
+)
 
 database = client[DATABASE_NAME]
 employers_collection = database["employers"]
 employees_collection = database["employees"]
 attendance_collection = database["attendance"]
+attendance_archive_collection = database["attendance_archive"]
+payroll_runs_collection = database["payroll_runs"]
+attendance_rollups_collection = database["attendance_rollups"]
+locks_collection = database["locks"]
+face_jobs_collection = database["face_jobs"]
+idempotency_keys_collection = database["idempotency_keys"]
+# email -> {user_type, user_id, username, password}; _id is the email, so lookups use the _id index.
+users_by_email_collection = database["users_by_email"]
+# Capped collection carrying dashboard events between workers (see events.MongoBroker).
+events_collection = database["events"]
+
+
+
+def for_reporting(collection):
+    """Same collection routed to secondaries when available, for reports and dashboards."""
+    return collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+
+# Open sessions are stored with an explicit null check_out. Matching on $type lets
+# the planner use the partial indexes below, which only hold open sessions.
+OPEN_SESSION = {"check_out": {"$type": "null"}}
+
+# Every index the application relies on, per collection. The startup hook
+# reconciles the database against this spec and query_audit.py checks that
+# the query shapes used by the routes are served by it.
+INDEX_SPEC = {
+    "employers": [
+        IndexModel("email", unique=True),
+    ],
+    "employees": [
+        IndexModel("email", unique=True),
+        IndexModel("employer_id"),
+    ],
+    "attendance": [
+        IndexModel([("employee_id", 1), ("check_in", 1)]),
+        IndexModel([("employee_id", 1), ("paid", 1), ("check_in", 1)]),
+        IndexModel([("employer_id", 1), ("check_in", 1)]),
+        IndexModel("employee_id", name="open_sessions_by_employee", partialFilterExpression=OPEN_SESSION),
+        IndexModel("check_in", name="open_sessions_by_check_in", partialFilterExpression=OPEN_SESSION),
+        IndexModel("check_out", name="paid_sessions_by_check_out", partialFilterExpression={"paid": True}),
+        IndexModel(
+            "payroll_run_id",
+            name="sessions_by_payroll_run",
+            partialFilterExpression={"payroll_run_id": {"$exists": True}}
+        ),
+    ],
+    "attendance_archive": [
+        IndexModel([("employee_id", 1), ("check_in", 1)]),
+        IndexModel([("employer_id", 1), ("check_in", 1)]),
+    ],
+    "payroll_runs": [
+        IndexModel([("employer_id", 1), ("period_start", 1), ("period_end", 1)], unique=True),
+    ],
+    "face_jobs": [
+        IndexModel([("status", 1), ("created_at", 1)]),
+        IndexModel("created_at", name="face_jobs_ttl", expireAfterSeconds=3600),
+    ],
+    "idempotency_keys": [
+        IndexModel(
+            "created_at",
+            name="idempotency_keys_ttl",
+            expireAfterSeconds=int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+        ),
+    ],
+    "attendance_rollups": [
+        IndexModel([("employer_id", 1), ("employee_id", 1), ("bucket", 1)], unique=True),
+        IndexModel([("employer_id", 1), ("granularity", 1), ("bucket_start", 1)]),
+    ],
+}
+
+INDEX_OPTIONS = ("unique", "partialFilterExpression", "expireAfterSeconds")
+
+
+def _option_drift(existing: dict, model: IndexModel):
+    """Options of an existing index that differ from the spec, or None if its keys differ."""
+    wanted = model.document
+    if list(existing["key"]) != list(wanted["key"].items()):
+        return None
+    return [option for option in INDEX_OPTIONS if existing.get(option) != wanted.get(option)]
+
+
+async def _reconcile_index(collection, name: str, existing: dict, model: IndexModel, rebuild_drifted: bool):
+    if name not in existing:
+        await collection.create_indexes([model])
+        print(f"➕ Created index {collection.name}.{name}")
+        return
+
+    drift = _option_drift(existing[name], model)
+    if drift == []:
+        return
+    if drift == ["expireAfterSeconds"]:
+        # A TTL change is applied in place; the index keeps serving queries.
+        await collection.database.command({
+            "collMod": collection.name,
+            "index": {"name": name, "expireAfterSeconds": model.document["expireAfterSeconds"]},
+        })
+        print(f"🔁 Updated TTL of index {collection.name}.{name}")
+        return
+    if not rebuild_drifted:
+        print(f"⚠️ Index {collection.name}.{name} differs from spec; run `python database.py --rebuild-drifted`")
+        return
+
+    print(f"🔁 Rebuilding index {collection.name}.{name} to match spec")
+    await collection.drop_index(name)
+    await collection.create_indexes([model])
+
+
+async def reconcile_indexes(db=None, rebuild_drifted: bool = False, drop_undeclared: bool = False):
+    """Bring the indexes of a database in line with INDEX_SPEC.
+
+    Missing indexes are created and TTL changes applied in place. Dropping and
+    rebuilding a drifted index, which lifts its constraints while it rebuilds, and
+    dropping undeclared indexes only happen when explicitly asked for. Every index
+    is reconciled on its own so one failure does not stop the rest.
+    """
+    db = database if db is None else db
+    for collection_name, models in INDEX_SPEC.items():
+        collection = db[collection_name]
+        try:
+            existing = await collection.index_information()
+        except Exception as e:
+            print(f"❌ Could not list indexes of {collection_name}: {e}")
+            continue
+        declared = {model.document["name"] for model in models}
+
+        for model in models:
+            name = model.document["name"]
+            try:
+                await _reconcile_index(collection, name, existing, model, rebuild_drifted)
+            except Exception as e:
+                print(f"❌ Failed to reconcile index {collection_name}.{name}: {e}")
+
+        for name in existing:
+            if name == "_id_" or name in declared:
+                continue
+            if not drop_undeclared:
+                print(f"⚠️ Undeclared index {collection_name}.{name}")
+                continue
+            try:
+                await collection.drop_index(name)
+                print(f"➖ Dropped undeclared index {collection_name}.{name}")
+            except Exception as e:
+                print(f"❌ Failed to drop index {collection_name}.{name}: {e}")
+
 
 async def create_indexes():
     """Create necessary indexes for collections."""
     try:
-        await employers_collection.create_index("email", unique=True)
-        await employees_collection.create_index("email", unique=True)
-        await attendance_collection.create_index("employee_id")
+        await reconcile_indexes()
         print("✅ Indexes created successfully!")
     except Exception as e:
         print(f"❌ Failed to create indexes: {e}")
 
+async def connect_database():
+    """Verify the cluster is reachable when the app starts."""
+    await client.admin.command("ping")
+    print(f"✅ Connected to MongoDB (pool {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE})")
+
+
+def close_database():
+    client.close()
+
+
+async def database_readiness():
+    """Ping latency and pool utilisation, for the readiness endpoint."""
+    start = time.perf_counter()
+    try:
+        await client.admin.command("ping")
+        ping_ms = round((time.perf_counter() - start) * 1000, 2)
+        ready = True
+    except Exception as e:
+        print(f"❌ Readiness ping failed: {e}")
+        ping_ms = None
+        ready = False
+
+    return {
+        "ready": ready,
+        "ping_ms": ping_ms,
+        "pool": {
+            "max_size": MONGO_MAX_POOL_SIZE,
+            "open_connections": pool_stats.open,
+            "checked_out": pool_stats.checked_out,
+            "utilization": round(pool_stats.checked_out / MONGO_MAX_POOL_SIZE, 3),
+            "checkout_failures": pool_stats.checkout_failures,
+        },
+    }
+
+
 def get_database():
     return database
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile MongoDB indexes with INDEX_SPEC.")
+    parser.add_argument("--rebuild-drifted", action="store_true", help="drop and rebuild indexes whose options drifted")
+    parser.add_argument("--drop-undeclared", action="store_true", help="drop indexes missing from the spec")
+    args = parser.parse_args()
+    asyncio.run(reconcile_indexes(rebuild_drifted=args.rebuild_drifted, drop_undeclared=args.drop_undeclared))
@@ -0,0 +1,161 @@
+import asyncio
+import os
+from collections import defaultdict, OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+from database import database, events_collection
+
+SUBSCRIBER_QUEUE_SIZE = 1000
+EVENTS_CAPPED_SIZE_BYTES = int(os.getenv("EVENTS_CAPPED_SIZE_BYTES", str(16 * 1024 * 1024)))
+TAIL_RETRY_SECONDS = 1
+# ObjectIds from different workers are not ordered within a second (or across clock
+# skew), so a reopened tail re-reads this much history and drops what it has seen.
+TAIL_OVERLAP_SECONDS = 5
+TAIL_SEEN_SIZE = 10000
+RESYNC_EVENT = {"type": "resync"}
+
+
+def employer_channel(employer_id: str) -> str:
+    """Channel carrying dashboard events for one employer."""
+    return f"employer:{employer_id}"
+
+
+class InProcessBroker:
+    """Pub/sub that fans events out to subscribers inside this worker only.
+
+    A cross-worker backend (Redis, Mongo change streams, ...) only needs to provide
+    the same async ``publish`` and ``subscribe`` methods and be installed with
+    ``set_broker`` at startup.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+
+    async def publish(self, channel: str, event: dict):
+        for queue in list(self._subscribers.get(channel, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # The subscriber fell too far behind; drop its backlog and ask it to re-snapshot.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC_EVENT)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[channel].add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers[channel].discard(queue)
+            if not self._subscribers[channel]:
+                del self._subscribers[channel]
+
+
+class MongoBroker:
+    """Pub/sub across workers through a capped collection.
+
+    Publishing inserts the event; each subscribing worker runs one tailable cursor
+    and fans what it reads out to its local subscribers through an InProcessBroker.
+    Face workers that only publish never open a cursor.
+    """
+
+    def __init__(self, collection=events_collection):
+        self._collection = collection
+        self._local = InProcessBroker()
+        self._tailer = None
+
+    async def start(self):
+        try:
+            await database.create_collection(self._collection.name, capped=True, size=EVENTS_CAPPED_SIZE_BYTES)
+        except CollectionInvalid:
+            pass  # already created by another worker
+
+    async def close(self):
+        if self._tailer is not None:
+            self._tailer.cancel()
+            try:
+                await self._tailer
+            except asyncio.CancelledError:
+                pass
+            self._tailer = None
+
+    async def publish(self, channel: str, event: dict):
+        await self._collection.insert_one({"channel": channel, "event": event, "created_at": datetime.utcnow()})
+
+    def _resume_filter(self, last_id):
+        if last_id is None:
+            return {}
+        since = last_id.generation_time - timedelta(seconds=TAIL_OVERLAP_SECONDS)
+        return {"_id": {"$gte": ObjectId.from_datetime(since)}}
+
+    async def _tail(self):
+        seen = OrderedDict()
+
+        def remember(event_id):
+            seen[event_id] = None
+            while len(seen) > TAIL_SEEN_SIZE:
+                seen.popitem(last=False)
+
+        # Mark the newest events as seen so a new worker does not replay them.
+        latest = await self._collection.find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+        last_id = latest["_id"] if latest else None
+        if last_id is not None:
+            async for document in self._collection.find(self._resume_filter(last_id), {"_id": 1}):
+                remember(document["_id"])
+
+        while True:
+            try:
+                cursor = self._collection.find(self._resume_filter(last_id), cursor_type=CursorType.TAILABLE_AWAIT)
+                async for document in cursor:
+                    if document["_id"] in seen:
+                        continue
+                    remember(document["_id"])
+                    last_id = document["_id"]
+                    await self._local.publish(document["channel"], document["event"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Event tail failed: {e}")
+                # Events may have been missed; have every local dashboard re-snapshot.
+                for channel in list(self._local._subscribers):
+                    await self._local.publish(channel, RESYNC_EVENT)
+            # Tailable cursors die on an empty collection or when they fall behind; reopen.
+            await asyncio.sleep(TAIL_RETRY_SECONDS)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        if self._tailer is None:
+            self._tailer = asyncio.create_task(self._tail())
+        async with self._local.subscribe(channel) as queue:
+            yield queue
+
+
+_broker = InProcessBroker()
+
+
+def get_broker():
+    return _broker
+
+
+def set_broker(broker):
+    """Swap the active broker, e.g. for a cross-worker implementation."""
+    global _broker
+    _broker = broker
+
+
+async def publish(channel: str, event: dict):
+    """Publish an event, never letting a broker failure break the request that caused it."""
+    try:
+        await _broker.publish(channel, event)
+    except Exception as e:
+        print(f"❌ Failed to publish event on {channel}: {e}")
+
+
+def subscribe(channel: str):
+    return _broker.subscribe(channel)
@@ -0,0 +1,159 @@
+import asyncio
+import csv
+import importlib.util
+import io
+from datetime import datetime
+from pymongo import UpdateMany
+
+from database import attendance_collection, attendance_archive_collection, employees_collection, for_reporting
+from archive import iter_sessions
+
+EXPORT_BATCH_SIZE = 5000
+EXPORT_COLUMNS = [
+    "session_id",
+    "employee_id",
+    "username",
+    "email",
+    "check_in",
+    "check_out",
+    "hours_worked",
+    "earnings",
+    "paid",
+]
+
+
+def parquet_available() -> bool:
+    """Parquet export is optional on lean images; checked without importing pyarrow."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands back whatever has been written since the last drain."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+async def _employee_directory(employer_id: str):
+    directory = {}
+    async for employee in for_reporting(employees_collection).find(
+        {"employer_id": employer_id}, {"username": 1, "email": 1}
+    ):
+        directory[str(employee["_id"])] = employee
+    return directory
+
+
+async def iter_session_batches(employer_id: str, start: datetime, end: datetime):
+    """Yield lists of export rows, one Motor batch at a time, in check-in order across both tiers."""
+    directory = await _employee_directory(employer_id)
+    cursor = iter_sessions(
+        {"employer_id": employer_id, "check_in": {"$gte": start, "$lt": end}},
+        {"employee_id": 1, "check_in": 1, "check_out": 1, "hours_worked": 1, "earnings": 1, "paid": 1},
+        batch_size=EXPORT_BATCH_SIZE,
+        reporting=True
+    )
+
+    batch = []
+    async for session in cursor:
+        employee = directory.get(session["employee_id"], {})
+        batch.append({
+            "session_id": str(session["_id"]),
+            "employee_id": session["employee_id"],
+            "username": employee.get("username"),
+            "email": employee.get("email"),
+            "check_in": session.get("check_in"),
+            "check_out": session.get("check_out"),
+            "hours_worked": session.get("hours_worked"),
+            "earnings": session.get("earnings"),
+            "paid": session.get("paid", False),
+        })
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def stream_csv(employer_id: str, start: datetime, end: datetime):
+    """Stream sessions as CSV text, flushing once per cursor batch."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+
+    async for batch in iter_session_batches(employer_id, start, end):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def stream_parquet(employer_id: str, start: datetime, end: datetime):
+    """Stream sessions as a Parquet file with one row group per cursor batch."""
+    # Imported here so workers that never export Parquet do not pay for pyarrow.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("session_id", pa.string()),
+        ("employee_id", pa.string()),
+        ("username", pa.string()),
+        ("email", pa.string()),
+        ("check_in", pa.timestamp("ms")),
+        ("check_out", pa.timestamp("ms")),
+        ("hours_worked", pa.float64()),
+        ("earnings", pa.float64()),
+        ("paid", pa.bool_()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    async for batch in iter_session_batches(employer_id, start, end):
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+async def backfill_employer_ids():
+    """Copy each employee's employer_id onto hot and archived sessions recorded before it was stored there."""
+    operations = []
+    async for employee in employees_collection.find({}, {"employer_id": 1}):
+        operations.append(UpdateMany(
+            {"employee_id": str(employee["_id"]), "employer_id": {"$exists": False}},
+            {"$set": {"employer_id": employee.get("employer_id")}}
+        ))
+
+    updated = 0
+    # Archived sessions are exported too, so they need the field as much as hot ones.
+    for collection in (attendance_collection, attendance_archive_collection):
+        for i in range(0, len(operations), 1000):
+            result = await collection.bulk_write(operations[i:i + 1000], ordered=False)
+            updated += result.modified_count
+
+    print(f"✅ Attached employer_id to {updated} attendance sessions")
+    return updated
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill_employer_ids())
@@ -0,0 +1,181 @@
+"""Find every pair of enrolled faces closer than the match tolerance.
+
+Usage:
+    python face_audit.py [--output pairs.csv] [--tolerance 0.6] [--tile-size 2048] [--processes N]
+
+Every employer and employee encoding is loaded into one float32 matrix and
+compared in square tiles. Each tile is a single matrix multiply run in a
+worker process, so memory stays at one tile per worker however many faces
+are enrolled. Pairs are written as CSV (to stdout by default) as soon as
+their tile finishes, so the output order is not stable between runs.
+
+A pair under tolerance is either the same person enrolled twice or two
+people the login would confuse; ``same_employer`` helps tell them apart.
+"""
+import os
+
+# One BLAS thread per worker: the parallelism comes from the process pool.
+for _variable in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_variable, "1")
+
+import argparse
+import asyncio
+import csv
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from database import employers_collection, employees_collection
+
+ENCODING_SIZE = 128
+DEFAULT_TOLERANCE = 0.6
+DEFAULT_TILE_SIZE = 2048
+AUDIT_PROCESSES = int(os.getenv("AUDIT_PROCESSES", str(os.cpu_count() or 1)))
+OUTPUT_COLUMNS = [
+    "distance",
+    "user_type_a",
+    "user_id_a",
+    "employer_id_a",
+    "user_type_b",
+    "user_id_b",
+    "employer_id_b",
+    "same_employer",
+]
+
+# Encoding matrix opened read-only in each worker process.
+_encodings = None
+
+
+async def load_encodings():
+    """Return (owners, matrix): one (user_type, user_id, employer_id) per row of encodings.
+
+    Rows are copied straight into a preallocated float32 matrix, so peak memory
+    stays close to the matrix itself rather than to lists of Python floats.
+    """
+    sources = (("employer", employers_collection), ("employee", employees_collection))
+    query = {"face_encoding": {"$exists": True}}
+    capacity = 0
+    for _, collection in sources:
+        capacity += await collection.count_documents(query)
+    matrix = np.empty((max(capacity, 1), ENCODING_SIZE), dtype=np.float32)
+
+    owners, skipped = [], 0
+    for user_type, collection in sources:
+        async for user in collection.find(query, {"face_encoding": 1, "employer_id": 1}):
+            encoding = user.get("face_encoding") or []
+            if len(encoding) != ENCODING_SIZE:
+                skipped += 1
+                continue
+            if len(owners) == len(matrix):
+                # Faces enrolled after counting; grow rather than fail.
+                matrix = np.resize(matrix, (len(matrix) * 2, ENCODING_SIZE))
+            matrix[len(owners)] = encoding
+            user_id = str(user["_id"])
+            # An employer's own face belongs to their own company.
+            employer_id = user_id if user_type == "employer" else user.get("employer_id")
+            owners.append((user_type, user_id, employer_id))
+
+    if skipped:
+        print(f"⚠️ Skipped {skipped} users without a valid {ENCODING_SIZE}-d encoding", file=sys.stderr)
+    return owners, matrix[:len(owners)]
+
+
+def _open_encodings(path: str):
+    global _encodings
+    _encodings = np.load(path, mmap_mode="r")
+
+
+def compare_tile(rows: tuple, cols: tuple, tolerance: float):
+    """Return (row, col, distance) for every pair in one tile that is within tolerance."""
+    a = np.asarray(_encodings[rows[0]:rows[1]])
+    b = np.asarray(_encodings[cols[0]:cols[1]])
+
+    # |a - b|^2 = |a|^2 + |b|^2 - 2ab, so the whole tile is one matrix multiply.
+    squared = np.einsum("ij,ij->i", a, a)[:, None] + np.einsum("ij,ij->i", b, b)[None, :]
+    squared -= 2.0 * (a @ b.T)
+    np.maximum(squared, 0.0, out=squared)
+
+    within = squared <= tolerance * tolerance
+    if rows == cols:
+        # Diagonal tiles hold each pair twice and every face against itself.
+        within = np.triu(within, k=1)
+    i, j = np.nonzero(within)
+    distances = np.sqrt(squared[i, j])
+    return [
+        (rows[0] + int(x), cols[0] + int(y), float(distance))
+        for x, y, distance in zip(i, j, distances)
+    ]
+
+
+def iter_tiles(count: int, tile_size: int):
+    """Upper-triangle tiles, including the diagonal, covering every unordered pair once."""
+    for start in range(0, count, tile_size):
+        rows = (start, min(start + tile_size, count))
+        for col_start in range(start, count, tile_size):
+            yield rows, (col_start, min(col_start + tile_size, count))
+
+
+def run_audit(owners: list, matrix, output, tolerance: float, tile_size: int, processes: int):
+    """Compare every pair of encodings across a process pool and write matches as they arrive."""
+    writer = csv.writer(output)
+    writer.writerow(OUTPUT_COLUMNS)
+
+    tiles = iter_tiles(len(owners), tile_size)
+    total_tiles = sum(1 for _ in iter_tiles(len(owners), tile_size))
+    finished = matches = 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "encodings.npy")
+        np.save(path, matrix)
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=_open_encodings, initargs=(path,)) as executor:
+            in_flight = set()
+
+            def collect(done):
+                nonlocal finished, matches
+                for future in done:
+                    for row, col, distance in future.result():
+                        type_a, id_a, employer_a = owners[row]
+                        type_b, id_b, employer_b = owners[col]
+                        writer.writerow([f"{distance:.4f}", type_a, id_a, employer_a, type_b, id_b, employer_b,
+                                         employer_a is not None and employer_a == employer_b])
+                        matches += 1
+                    finished += 1
+                    if finished % 100 == 0:
+                        print(f"🔄 {finished}/{total_tiles} tiles compared, {matches} pairs so far...", file=sys.stderr)
+
+            # Bounded queue of tiles so a huge enrolment never materialises every task at once.
+            for rows, cols in tiles:
+                in_flight.add(executor.submit(compare_tile, rows, cols, tolerance))
+                if len(in_flight) >= processes * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(wait(in_flight)[0])
+
+    return matches
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="List every pair of enrolled faces within the match tolerance.")
+    parser.add_argument("--output", default="-", help="CSV path, or - for stdout")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE, help="encodings per tile side")
+    parser.add_argument("--processes", type=int, default=AUDIT_PROCESSES)
+    args = parser.parse_args()
+
+    owners, matrix = await load_encodings()
+    print(f"🔍 Comparing {len(owners)} enrolled faces at tolerance {args.tolerance}", file=sys.stderr)
+
+    if args.output == "-":
+        matches = run_audit(owners, matrix, sys.stdout, args.tolerance, args.tile_size, args.processes)
+    else:
+        with open(args.output, "w", newline="") as output:
+            matches = run_audit(owners, matrix, output, args.tolerance, args.tile_size, args.processes)
+
+    print(f"✅ Face audit complete: {matches} pairs within tolerance", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime
+from bson import Binary
+import json
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from pymongo import ReturnDocument
+
+from database import face_jobs_collection
+from utils import get_face_encoding, get_chip_encoding, ImageQualityError
+import metrics
+
+# "local" encodes in this process, "mongo" hands jobs to face_worker.py processes
+# through the face_jobs collection, "memory" uses an in-process queue (tests).
+FACE_QUEUE = os.getenv("FACE_QUEUE", "local")
+FACE_QUEUE_CLAIM_TIMEOUT = float(os.getenv("FACE_QUEUE_CLAIM_TIMEOUT", "2"))
+FACE_QUEUE_RESULT_TIMEOUT = float(os.getenv("FACE_QUEUE_RESULT_TIMEOUT", "15"))
+POLL_INTERVAL_SECONDS = 0.05
+MAX_POLL_INTERVAL_SECONDS = 0.25
+
+
+def execute_job(kind: str, payload: bytes, options: dict = None):
+    """Run a face job and return a serialisable outcome; used by workers and the local fallback."""
+    options = options or {}
+    try:
+        if kind == "encode":
+            return {"result": get_face_encoding(payload)}
+        if kind == "encode_chip":
+            return {"result": get_chip_encoding(payload, options.get("landmarks"))}
+        return {"error": {"status_code": 400, "detail": f"Unknown face job kind: {kind}"}}
+    except ImageQualityError as e:
+        return {"error": {"status_code": e.status_code, "detail": e.detail, "quality_code": e.code}}
+    except HTTPException as e:
+        return {"error": {"status_code": e.status_code, "detail": e.detail}}
+    except Exception as e:
+        return {"error": {"status_code": 500, "detail": f"Face job failed: {str(e)}"}}
+
+
+class MongoFaceQueue:
+    """Job queue stored in the face_jobs collection, shared by every API and worker process."""
+
+    async def submit(self, kind: str, payload: bytes, options: dict = None):
+        result = await face_jobs_collection.insert_one({
+            "kind": kind,
+            "payload": Binary(payload),
+            "options": options or {},
+            "status": "pending",
+            "created_at": datetime.utcnow(),
+        })
+        return result.inserted_id
+
+    async def _poll(self, job_id, done, timeout: float):
+        deadline = asyncio.get_running_loop().time() + timeout
+        interval = POLL_INTERVAL_SECONDS
+        while True:
+            job = await face_jobs_collection.find_one({"_id": job_id}, {"payload": 0})
+            if job is None or done(job):
+                return job
+            if asyncio.get_running_loop().time() + interval > deadline:
+                return None
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL_SECONDS)
+
+    async def wait_claimed(self, job_id, timeout: float) -> bool:
+        return await self._poll(job_id, lambda job: job["status"] != "pending", timeout) is not None
+
+    async def wait_result(self, job_id, timeout: float):
+        job = await self._poll(job_id, lambda job: job["status"] == "done", timeout)
+        if job is None:
+            raise asyncio.TimeoutError
+        return job["outcome"]
+
+    async def cancel(self, job_id) -> bool:
+        result = await face_jobs_collection.update_one(
+            {"_id": job_id, "status": "pending"},
+            {"$set": {"status": "cancelled"}}
+        )
+        return result.modified_count == 1
+
+    async def claim(self, worker_id: str, timeout: float):
+        return await face_jobs_collection.find_one_and_update(
+            {"status": "pending"},
+            {"$set": {"status": "running", "claimed_by": worker_id, "claimed_at": datetime.utcnow()}},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def complete(self, job_id, outcome: dict):
+        await face_jobs_collection.update_one(
+            {"_id": job_id},
+            {"$set": {"status": "done", "outcome": outcome, "completed_at": datetime.utcnow()},
+             "$unset": {"payload": ""}}
+        )
+
+
+class InProcessFaceQueue:
+    """Same interface as MongoFaceQueue, backed by asyncio primitives in one process."""
+
+    def __init__(self):
+        self._pending = asyncio.Queue()
+        self._jobs = {}
+
+    async def submit(self, kind: str, payload: bytes, options: dict = None):
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = {
+            "_id": job_id,
+            "kind": kind,
+            "payload": payload,
+            "options": options or {},
+            "status": "pending",
+            "claimed": asyncio.Event(),
+            "done": asyncio.get_running_loop().create_future(),
+        }
+        await self._pending.put(job_id)
+        return job_id
+
+    async def wait_claimed(self, job_id, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._jobs[job_id]["claimed"].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait_result(self, job_id, timeout: float):
+        outcome = await asyncio.wait_for(asyncio.shield(self._jobs[job_id]["done"]), timeout)
+        self._jobs.pop(job_id, None)
+        return outcome
+
+    async def cancel(self, job_id) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] != "pending":
+            return False
+        job["status"] = "cancelled"
+        self._jobs.pop(job_id)
+        return True
+
+    async def claim(self, worker_id: str, timeout: float):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            remaining = deadline - asyncio.get_running_loop().time()
+            try:
+                job_id = await asyncio.wait_for(self._pending.get(), max(remaining, 0))
+            except asyncio.TimeoutError:
+                return None
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != "pending":
+                continue  # cancelled while queued
+            job["status"] = "running"
+            job["claimed"].set()
+            return job
+
+    async def complete(self, job_id, outcome: dict):
+        job = self._jobs.get(job_id)
+        if job is not None and not job["done"].done():
+            job["status"] = "done"
+            job["done"].set_result(outcome)
+
+
+_transport = None
+
+
+def get_transport():
+    global _transport
+    if _transport is None and FACE_QUEUE != "local":
+        _transport = MongoFaceQueue() if FACE_QUEUE == "mongo" else InProcessFaceQueue()
+    return _transport
+
+
+def set_transport(transport):
+    """Install a transport explicitly, e.g. an InProcessFaceQueue shared with a test worker."""
+    global _transport
+    _transport = transport
+
+
+def _raise_for_outcome(outcome: dict):
+    # Counted here rather than in execute_job so jobs run by other processes are included.
+    error = outcome.get("error")
+    if error and "quality_code" in error:
+        metrics.increment(f"face_quality.rejected.{error['quality_code']}")
+        raise ImageQualityError(error["quality_code"], error["detail"]["message"])
+    if error:
+        raise HTTPException(status_code=error["status_code"], detail=error["detail"])
+    metrics.increment("face_quality.accepted")
+    return outcome["result"]
+
+
+async def _run_locally(kind: str, payload: bytes, options: dict = None):
+    return _raise_for_outcome(await run_in_threadpool(execute_job, kind, payload, options))
+
+
+async def run_face_job(kind: str, payload: bytes, options: dict = None):
+    """Run a face job on an inference worker, or locally if none picks it up in time."""
+    transport = get_transport()
+    if transport is None:
+        return await _run_locally(kind, payload, options)
+
+    job_id = await transport.submit(kind, payload, options)
+    metrics.increment("face_queue.submitted")
+
+    if not await transport.wait_claimed(job_id, FACE_QUEUE_CLAIM_TIMEOUT):
+        if await transport.cancel(job_id):
+            metrics.increment("face_queue.local_fallbacks")
+            print("⚠️ No face worker claimed the job in time; encoding locally")
+            return await _run_locally(kind, payload, options)
+
+    try:
+        outcome = await transport.wait_result(job_id, FACE_QUEUE_RESULT_TIMEOUT)
+    except asyncio.TimeoutError:
+        metrics.increment("face_queue.timeouts")
+        print("⚠️ Face worker timed out; encoding locally")
+        return await _run_locally(kind, payload, options)
+
+    metrics.increment("face_queue.completed")
+    return _raise_for_outcome(outcome)
+
+
+async def encode_face(image_bytes: bytes):
+    """Async replacement for utils.get_face_encoding that never blocks the event loop."""
+    return await run_face_job("encode", image_bytes)
+
+
+async def encode_upload(image: UploadFile = None, chip: UploadFile = None, landmarks: str = None):
+    """Encode whichever face input a multipart request carried: a full image or an aligned chip."""
+    if chip is not None:
+        try:
+            parsed_landmarks = json.loads(landmarks) if landmarks else None
+        except ValueError:
+            raise ImageQualityError("invalid_chip", "Landmarks must be valid JSON.")
+        metrics.increment("face_chip.submitted")
+        return await run_face_job("encode_chip", await chip.read(), {"landmarks": parsed_landmarks})
+
+    if image is None:
+        raise HTTPException(status_code=400, detail="An image or a face chip is required")
+    return await encode_face(await image.read())
@@ -0,0 +1,76 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from face_queue import execute_job, MongoFaceQueue
+from locks import WORKER_ID
+from utils import warm_up_face_backend
+import metrics
+
+FACE_WORKER_CONCURRENCY = int(os.getenv("FACE_WORKER_CONCURRENCY", str(os.cpu_count() or 1)))
+CLAIM_POLL_SECONDS = 0.1
+MAX_BACKOFF_SECONDS = 5
+
+
+def _init_process():
+    warm_up_face_backend()
+
+
+def _new_executor(concurrency: int):
+    return ProcessPoolExecutor(max_workers=concurrency, initializer=_init_process)
+
+
+async def _fail_job(transport, job, error: Exception):
+    """Complete a claimed job with an error so its caller stops waiting for it."""
+    try:
+        await transport.complete(job["_id"], {
+            "error": {"status_code": 503, "detail": f"Face worker failed: {str(error)}"}
+        })
+    except Exception as e:
+        print(f"❌ Could not mark face job {job['_id']} as failed: {e}")
+
+
+async def run_worker(transport, concurrency: int = FACE_WORKER_CONCURRENCY, executor=None):
+    """Claim face jobs and run them on a pool of processes, one job per core at a time."""
+    loop = asyncio.get_running_loop()
+    owns_executor = executor is None
+    executor = executor or _new_executor(concurrency)
+
+    async def slot():
+        nonlocal executor
+        backoff = CLAIM_POLL_SECONDS
+        while True:
+            job = None
+            pool = executor
+            try:
+                job = await transport.claim(WORKER_ID, CLAIM_POLL_SECONDS)
+                if job is None:
+                    await asyncio.sleep(CLAIM_POLL_SECONDS)
+                    continue
+                outcome = await loop.run_in_executor(
+                    pool, execute_job, job["kind"], bytes(job["payload"]), job.get("options")
+                )
+                await transport.complete(job["_id"], outcome)
+                backoff = CLAIM_POLL_SECONDS
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.increment("face_worker.errors")
+                print(f"❌ Face worker slot failed: {e!r}")
+                if job is not None:
+                    await _fail_job(transport, job, e)
+                if isinstance(e, BrokenProcessPool) and owns_executor and executor is pool:
+                    # A crashed child breaks the whole pool; the first slot to notice replaces it.
+                    executor = _new_executor(concurrency)
+                    pool.shutdown(wait=False)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+    print(f"🧠 Face worker {WORKER_ID} running {concurrency} slots")
+    await asyncio.gather(*(slot() for _ in range(concurrency)))
+
+
+if __name__ == "__main__":
+    # Standalone workers always talk to the shared Mongo queue.
+    asyncio.run(run_worker(MongoFaceQueue()))
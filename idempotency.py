@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo.errors import DuplicateKeyError
+
+from database import idempotency_keys_collection
+import metrics
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IN_FLIGHT_TIMEOUT_SECONDS = 60
+CACHE_SIZE = 10000
+POLL_INTERVAL_SECONDS = 0.1
+
+# Front cache of completed responses: key -> (expires_at, body).
+_cache = OrderedDict()
+# Requests currently being handled by this process: key -> Future of the body.
+_in_flight = {}
+
+
+def _cache_get(key: str):
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    expires_at, body = entry
+    if expires_at < time.monotonic():
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    return body
+
+
+def _cache_put(key: str, body):
+    _cache[key] = (time.monotonic() + IDEMPOTENCY_TTL_SECONDS, body)
+    _cache.move_to_end(key)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def _replay(body):
+    metrics.increment("idempotency.replays")
+    return JSONResponse(content=body, headers={"Idempotent-Replayed": "true"})
+
+
+async def _claim(key: str):
+    """Reserve a key for this request, or return the body another worker already stored for it."""
+    deadline = time.monotonic() + IN_FLIGHT_TIMEOUT_SECONDS
+    while True:
+        now = datetime.utcnow()
+        try:
+            await idempotency_keys_collection.insert_one({"_id": key, "status": "pending", "created_at": now})
+            return None
+        except DuplicateKeyError:
+            pass
+
+        # A pending key left behind by a crashed worker is taken over once it is stale.
+        taken_over = await idempotency_keys_collection.find_one_and_update(
+            {"_id": key, "status": "pending", "created_at": {"$lt": now - timedelta(seconds=IN_FLIGHT_TIMEOUT_SECONDS)}},
+            {"$set": {"created_at": now}}
+        )
+        if taken_over:
+            return None
+
+        record = await idempotency_keys_collection.find_one({"_id": key})
+        if record and record["status"] == "completed":
+            return record["body"]
+        if time.monotonic() > deadline:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+
+async def run_idempotent(key: str, handler):
+    """Run ``handler`` at most once per key and replay its response for retries.
+
+    Only successful responses are stored; if the handler raises, the key is
+    released so the client can retry with the same key.
+    """
+    body = _cache_get(key)
+    if body is not None:
+        return _replay(body)
+
+    if key in _in_flight:
+        # Same key already being handled in this process: wait for it instead of redoing the face work.
+        return _replay(await asyncio.shield(_in_flight[key]))
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    try:
+        body = await _claim(key)
+        if body is not None:
+            _cache_put(key, body)
+            future.set_result(body)
+            return _replay(body)
+
+        try:
+            response = await handler()
+        except BaseException:
+            await idempotency_keys_collection.delete_one({"_id": key, "status": "pending"})
+            raise
+
+        body = jsonable_encoder(response)
+        await idempotency_keys_collection.update_one(
+            {"_id": key},
+            {"$set": {"status": "completed", "body": body, "created_at": datetime.utcnow()}}
+        )
+        _cache_put(key, body)
+        future.set_result(body)
+        return response
+    except Exception as e:
+        if not future.done():
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting on it.
+            future.exception()
+        raise
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    finally:
+        _in_flight.pop(key, None)
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from pymongo import UpdateOne
+
+from database import (
+    users_by_email_collection,
+    employers_collection,
+    employees_collection,
+    INTERACTIVE_MAX_TIME_MS
+)
+
+# Until `python identity.py` has backfilled users_by_email, a miss also checks the
+# employer and employee collections. Set to false after the backfill so an unknown
+# email costs a single indexed read.
+IDENTITY_LEGACY_FALLBACK = os.getenv("IDENTITY_LEGACY_FALLBACK", "true").lower() == "true"
+
+# Only emails that miss repeatedly are cached, and briefly: the cache is per process,
+# so a user who just registered through another worker must not be locked out.
+NEGATIVE_CACHE_TTL_SECONDS = 5
+NEGATIVE_CACHE_MIN_MISSES = 2
+NEGATIVE_CACHE_SIZE = 50000
+IDENTITY_PROJECTION = {"user_type": 1, "user_id": 1, "username": 1, "password": 1}
+
+# Emails recently looked up and not found: email -> (misses, expires_at).
+_unknown_emails = OrderedDict()
+
+
+def _is_known_unknown(email: str) -> bool:
+    entry = _unknown_emails.get(email)
+    if entry is None:
+        return False
+    misses, expires_at = entry
+    if expires_at < time.monotonic():
+        del _unknown_emails[email]
+        return False
+    return misses >= NEGATIVE_CACHE_MIN_MISSES
+
+
+def _remember_unknown(email: str):
+    misses, expires_at = _unknown_emails.get(email, (0, 0))
+    if expires_at < time.monotonic():
+        misses = 0
+    _unknown_emails[email] = (misses + 1, time.monotonic() + NEGATIVE_CACHE_TTL_SECONDS)
+    _unknown_emails.move_to_end(email)
+    while len(_unknown_emails) > NEGATIVE_CACHE_SIZE:
+        _unknown_emails.popitem(last=False)
+
+
+def identity_operation(user_type: str, user: dict):
+    """Upsert that mirrors one employer/employee into users_by_email.
+
+    Employers overwrite an existing entry and employees only fill a missing one,
+    which keeps the old rule that an employer wins when both share an email.
+    """
+    fields = {
+        "user_type": user_type,
+        "user_id": str(user["_id"]),
+        "username": user["username"],
+        "password": user["password"],
+    }
+    update = {"$set": fields} if user_type == "employer" else {"$setOnInsert": fields}
+    return UpdateOne({"_id": user["email"]}, update, upsert=True)
+
+
+async def register_identities(user_type: str, users: list):
+    """Keep the identity index in sync after inserting employers or employees."""
+    if not users:
+        return
+    await users_by_email_collection.bulk_write(
+        [identity_operation(user_type, user) for user in users], ordered=False
+    )
+    for user in users:
+        _unknown_emails.pop(user["email"], None)
+
+
+async def lookup_identity(email: str):
+    """Resolve an email to {user_type, user_id, username, password} with one indexed read.
+
+    While IDENTITY_LEGACY_FALLBACK is on, accounts created before the index existed
+    are found in the legacy collections once and written back. Repeated misses are
+    cached briefly so attempts against unknown emails do not keep reaching Mongo.
+    """
+    if _is_known_unknown(email):
+        return None
+
+    identity = await users_by_email_collection.find_one(
+        {"_id": email}, IDENTITY_PROJECTION, max_time_ms=INTERACTIVE_MAX_TIME_MS
+    )
+    if identity:
+        return identity
+
+    if IDENTITY_LEGACY_FALLBACK:
+        for user_type, collection in (("employer", employers_collection), ("employee", employees_collection)):
+            user = await collection.find_one(
+                {"email": email}, {"username": 1, "password": 1, "email": 1}, max_time_ms=INTERACTIVE_MAX_TIME_MS
+            )
+            if user:
+                await register_identities(user_type, [user])
+                return {"user_type": user_type, "user_id": str(user["_id"]),
+                        "username": user["username"], "password": user["password"]}
+
+    _remember_unknown(email)
+    return None
+
+
+async def backfill_identities(batch_size: int = 1000):
+    """Populate users_by_email from every existing employee and employer."""
+    total = 0
+    # Employees first so employers sharing an email overwrite them.
+    for user_type, collection in (("employee", employees_collection), ("employer", employers_collection)):
+        batch = []
+        async for user in collection.find({}, {"username": 1, "password": 1, "email": 1}):
+            batch.append(user)
+            if len(batch) >= batch_size:
+                await register_identities(user_type, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            await register_identities(user_type, batch)
+            total += len(batch)
+
+    print(f"✅ Identity index backfilled with {total} users; IDENTITY_LEGACY_FALLBACK=false can now be set")
+    return total
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill_identities())
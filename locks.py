@@ -0,0 +1,32 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+
+from database import locks_collection
+
+# Identifies this process among all uvicorn workers and containers.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def acquire_lease(name: str, ttl_seconds: float) -> bool:
+    """Take or renew a named lease; return True when this worker holds it.
+
+    The lease is a single document keyed by name. It can only be taken over once
+    it has expired, so a crashed leader is replaced after at most ``ttl_seconds``.
+    """
+    now = datetime.utcnow()
+    try:
+        await locks_collection.find_one_and_update(
+            {"_id": name, "$or": [{"owner": WORKER_ID}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # The lease exists and is held by another worker.
+        return False
+
+
+async def release_lease(name: str):
+    await locks_collection.delete_one({"_id": name, "owner": WORKER_ID})
@@ -1,12 +1,17 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import uvicorn
 import os
 
-from database import create_indexes
-from routes.employee import router as employee_router
-from routes.employer import router as employer_router
+from database import create_indexes, connect_database, close_database, database_readiness
+from sweeper import start_sweeper, stop_sweeper
+from events import MongoBroker, get_broker, set_broker
+from utils import warm_up_face_backend
+import metrics
+from routes.employee import router as employee_router, face_router as employee_face_router
+from routes.employer import router as employer_router, face_router as employer_face_router
 from routes.attandance import router as attendance_router
 from auth import (
     login_with_password,
@@ -23,6 +28,21 @@ MONGO_URI = os.getenv("MONGO_URI")
 if not MONGO_URI:
     raise ValueError("❌ MONGO_URI is not set in .env file!")
 
+# Process role: "api" serves JSON/password routes only, "face" serves the face
+# pipeline only, "all" serves everything. Lean api workers never load dlib.
+APP_ROLE = os.getenv("APP_ROLE", "all")
+if APP_ROLE not in ("all", "api", "face"):
+    raise ValueError(f"❌ APP_ROLE must be one of all, api, face (got {APP_ROLE!r})")
+SERVES_API = APP_ROLE in ("all", "api")
+SERVES_FACE = APP_ROLE in ("all", "face")
+
+# Dashboard events: "memory" only reaches subscribers in the same process, so a
+# split deployment, where check-ins run on face workers and dashboards on api
+# workers, defaults to "mongo".
+EVENT_BROKER = os.getenv("EVENT_BROKER", "memory" if APP_ROLE == "all" else "mongo")
+if EVENT_BROKER not in ("memory", "mongo"):
+    raise ValueError(f"❌ EVENT_BROKER must be memory or mongo (got {EVENT_BROKER!r})")
+
 app = FastAPI(
     title="Attendance Management System",
     version="1.0",
@@ -48,28 +68,69 @@ app.add_middleware(
 # ✅ Health check
 @app.get("/")
 async def root():
-    return {"message": "Welcome to the Attendance Management System API 🚀"}
+    return {"message": "Welcome to the Attendance Management System API 🚀", "role": APP_ROLE}
+
+# ✅ Readiness (database reachability and pool utilisation)
+@app.get("/ready")
+async def readiness():
+    report = await database_readiness()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
+# ✅ Metrics
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
 
 # ✅ Authentication Routes
-app.post("/login/password")(login_with_password)
-app.post("/login/face")(login_with_face)
-app.post("/login/face/employer")(login_employer_with_face)
-app.post("/login/face/employee")(login_employee_with_face)
+if SERVES_API:
+    app.post("/login/password")(login_with_password)
+if SERVES_FACE:
+    app.post("/login/face")(login_with_face)
+    app.post("/login/face/employer")(login_employer_with_face)
+    app.post("/login/face/employee")(login_employee_with_face)
 
 # ✅ Feature Routers
-app.include_router(employer_router, prefix="/employer", tags=["Employer"])
-app.include_router(employee_router, prefix="/employee", tags=["Employee"])
-app.include_router(attendance_router, prefix="/attendance", tags=["Attendance"])
+if SERVES_API:
+    app.include_router(employer_router, prefix="/employer", tags=["Employer"])
+    app.include_router(employee_router, prefix="/employee", tags=["Employee"])
+if SERVES_FACE:
+    app.include_router(employer_face_router, prefix="/employer", tags=["Employer"])
+    app.include_router(employee_face_router, prefix="/employee", tags=["Employee"])
+    app.include_router(attendance_router, prefix="/attendance", tags=["Attendance"])
 
 # ✅ Startup Events
 @app.on_event("startup")
 async def startup_db():
+    try:
+        await connect_database()
+    except Exception as e:
+        print(f"❌ Error connecting to MongoDB: {e}")
+
     try:
         await create_indexes()
         print("✅ MongoDB indexes created successfully")
     except Exception as e:
         print(f"❌ Error creating indexes: {e}")
 
+    if EVENT_BROKER == "mongo":
+        broker = MongoBroker()
+        try:
+            await broker.start()
+        except Exception as e:
+            print(f"❌ Error creating the events collection: {e}")
+        set_broker(broker)
+
+    if SERVES_FACE:
+        warm_up_face_backend()
+    app.state.sweeper_task = start_sweeper() if SERVES_API else None
+
+@app.on_event("shutdown")
+async def shutdown_background_tasks():
+    await stop_sweeper(getattr(app.state, "sweeper_task", None))
+    if isinstance(get_broker(), MongoBroker):
+        await get_broker().close()
+    close_database()
+
 # ✅ Local run
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
@@ -0,0 +1,21 @@
+from collections import defaultdict
+from threading import Lock
+
+# Process-local counters and gauges, exposed as JSON at /metrics.
+_values = defaultdict(float)
+_lock = Lock()
+
+
+def increment(name: str, value: float = 1):
+    with _lock:
+        _values[name] += value
+
+
+def set_gauge(name: str, value: float):
+    with _lock:
+        _values[name] = value
+
+
+def snapshot():
+    with _lock:
+        return dict(sorted(_values.items()))
@@ -0,0 +1,191 @@
+import asyncio
+import csv
+import io
+import multiprocessing
+import os
+import posixpath
+import tarfile
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from database import employees_collection
+from face_queue import execute_job
+from identity import register_identities
+from utils import hash_password, warm_up_face_backend
+
+ONBOARDING_PROCESSES = int(os.getenv("ONBOARDING_PROCESSES", str(os.cpu_count() or 1)))
+MAX_IN_FLIGHT = ONBOARDING_PROCESSES * 2
+INSERT_BATCH_SIZE = 500
+REQUIRED_COLUMNS = ("username", "email", "password", "hourly_rate", "photo")
+
+
+def _new_executor():
+    """Process pool for one upload.
+
+    Spawned rather than forked, since the API process already runs Motor threads,
+    and shut down after the upload so the dlib models do not stay resident.
+    """
+    return ProcessPoolExecutor(
+        max_workers=ONBOARDING_PROCESSES,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=warm_up_face_backend
+    )
+
+
+def prepare_employee(image_bytes: bytes, password: str):
+    """Encode the face and hash the password of one row; runs in a worker process."""
+    outcome = execute_job("encode", image_bytes)
+    if "error" in outcome:
+        return outcome
+    return {"result": outcome["result"], "password": hash_password(password)}
+
+
+def parse_details(details_file):
+    """Read the details CSV into rows keyed by photo path, recording invalid rows in the report."""
+    # Decoded up front: Starlette's SpooledTemporaryFile cannot be wrapped in a
+    # TextIOWrapper before Python 3.11.
+    reader = csv.DictReader(io.StringIO(details_file.read().decode("utf-8-sig")))
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+
+    rows, report = {}, []
+    for number, row in enumerate(reader, start=1):
+        entry = {"row": number, "email": (row.get("email") or "").strip()}
+        try:
+            hourly_rate = float(row["hourly_rate"])
+        except (TypeError, ValueError):
+            report.append({**entry, "status": "invalid", "detail": "hourly_rate must be a number"})
+            continue
+        if not all((row.get(column) or "").strip() for column in REQUIRED_COLUMNS):
+            report.append({**entry, "status": "invalid", "detail": "Missing required value"})
+            continue
+
+        photo = posixpath.normpath(row["photo"].strip())
+        if photo in rows:
+            report.append({**entry, "status": "invalid", "detail": f"Photo {photo} used by more than one row"})
+            continue
+        rows[photo] = {
+            **entry,
+            "username": row["username"].strip(),
+            "password": row["password"],
+            "hourly_rate": hourly_rate,
+        }
+    return rows, report
+
+
+def iter_archive(archive_file, filename: str):
+    """Yield (path, bytes) for each file in a zip or tar upload, one entry at a time."""
+    if isinstance(archive_file, tempfile.SpooledTemporaryFile):
+        # Before Python 3.11 the spooled wrapper has no seekable(), which ZipFile
+        # needs; the BytesIO or temporary file underneath has it.
+        archive_file = archive_file._file
+
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive_file) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield posixpath.normpath(info.filename), archive.read(info)
+        return
+
+    # "r|*" reads the tar as a stream, so compressed archives never need seeking.
+    with tarfile.open(fileobj=archive_file, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile():
+                yield posixpath.normpath(member.name), archive.extractfile(member).read()
+
+
+async def _insert_batch(batch: list, report: list):
+    """Insert prepared (report entry, document) pairs and record the outcome of each row."""
+    documents = [document for _, document in batch]
+    try:
+        await employees_collection.insert_many(documents, ordered=False)
+        failed = {}
+    except BulkWriteError as e:
+        failed = {error["index"]: error.get("errmsg", "Insert failed") for error in e.details["writeErrors"]}
+
+    created = [document for index, (_, document) in enumerate(batch) if index not in failed]
+    await register_identities("employee", created)
+
+    # insert_many assigns _id to each document before sending it.
+    for index, (entry, document) in enumerate(batch):
+        if index in failed:
+            status = "duplicate" if "E11000" in failed[index] else "error"
+            report.append({**entry, "status": status, "detail": failed[index]})
+        else:
+            report.append({**entry, "status": "created", "id": str(document["_id"])})
+
+
+async def onboard_employees(employer_id: str, details_file, archive_file, archive_name: str):
+    """Register every employee described in the CSV whose photo is in the archive."""
+    rows, report = await run_in_threadpool(parse_details, details_file)
+
+    # One round trip for every duplicate-email check instead of one per row.
+    emails = [row["email"] for row in rows.values()]
+    existing = set()
+    async for employee in employees_collection.find({"email": {"$in": emails}}, {"email": 1}):
+        existing.add(employee["email"])
+
+    seen = set()
+    for photo, row in list(rows.items()):
+        if row["email"] in existing or row["email"] in seen:
+            report.append({"row": row["row"], "email": row["email"], "status": "duplicate",
+                           "detail": "Employee already exists"})
+            del rows[photo]
+        seen.add(row["email"])
+
+    loop = asyncio.get_running_loop()
+    executor = _new_executor()
+    in_flight = {}
+    batch = []
+
+    async def collect(done):
+        for future in done:
+            row = in_flight.pop(future)
+            outcome = future.result()
+            entry = {"row": row["row"], "email": row["email"]}
+            if "error" in outcome:
+                report.append({**entry, "status": "invalid", "detail": outcome["error"]["detail"]})
+                continue
+            batch.append((entry, {
+                "username": row["username"],
+                "email": row["email"],
+                "password": outcome["password"],
+                "face_encoding": outcome["result"],
+                "employer_id": employer_id,
+                "hourly_rate": row["hourly_rate"],
+            }))
+        if len(batch) >= INSERT_BATCH_SIZE:
+            await _insert_batch(batch, report)
+            batch.clear()
+
+    try:
+        # Reading and decompressing entries happens off the event loop.
+        async for path, image_bytes in iterate_in_threadpool(iter_archive(archive_file, archive_name)):
+            row = rows.pop(path, None)
+            if row is None:
+                continue
+            future = loop.run_in_executor(executor, prepare_employee, image_bytes, row["password"])
+            in_flight[future] = row
+            if len(in_flight) >= MAX_IN_FLIGHT:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                await collect(done)
+
+        if in_flight:
+            done, _ = await asyncio.wait(in_flight)
+            await collect(done)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if batch:
+        await _insert_batch(batch, report)
+
+    for photo, row in rows.items():
+        report.append({"row": row["row"], "email": row["email"], "status": "invalid",
+                       "detail": f"Photo {photo} not found in archive"})
+
+    report.sort(key=lambda entry: entry["row"])
+    return report
@@ -0,0 +1,200 @@
+"""Explain every query shape the API issues and flag the ones the indexes do not serve.
+
+Usage:
+    python query_audit.py [--seed] [--database NAME] [--max-ratio 10]
+
+The audit runs against a separate database (``<DATABASE_NAME>_query_audit`` by
+default) so it never touches production data. ``--seed`` drops and refills that
+database with synthetic employers, employees and sessions before explaining.
+The process exits with status 1 when any query regresses.
+"""
+import argparse
+import asyncio
+import random
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+from database import client, DATABASE_NAME, INDEX_SPEC, OPEN_SESSION, reconcile_indexes
+
+SEED_EMPLOYERS = 20
+SEED_EMPLOYEES_PER_EMPLOYER = 50
+SEED_SESSIONS_PER_EMPLOYEE = 40
+
+SAMPLE_EMPLOYER_ID = str(ObjectId())
+SAMPLE_EMPLOYEE_IDS = [str(ObjectId()) for _ in range(SEED_EMPLOYEES_PER_EMPLOYER)]
+NOW = datetime(2026, 1, 1)
+
+
+@dataclass
+class QueryShape:
+    name: str
+    source: str
+    collection: str
+    filter: dict
+    sort: dict = field(default_factory=dict)
+    # Queries that deliberately read every enrolled face.
+    allow_collscan: bool = False
+
+
+QUERY_SHAPES = [
+    QueryShape("identity by email", "identity.lookup_identity", "users_by_email", {"_id": "employee0@example.com"}),
+    QueryShape("employer by email", "identity.lookup_identity", "employers", {"email": "employer0@example.com"}),
+    QueryShape("employee by email", "identity.lookup_identity", "employees", {"email": "employee0@example.com"}),
+    QueryShape("employee by id", "auth.get_current_user", "employees", {"_id": ObjectId()}),
+    QueryShape("employee faces", "auth.login_with_face", "employees",
+               {"face_encoding": {"$exists": True}}, allow_collscan=True),
+    QueryShape("employer faces", "routes/employer.register_employer", "employers",
+               {"face_encoding": {"$exists": True}}, allow_collscan=True),
+    QueryShape("employees of employer", "routes/employer.get_employees", "employees",
+               {"employer_id": SAMPLE_EMPLOYER_ID}),
+    QueryShape("open session", "routes/attandance.check_in", "attendance",
+               {"employee_id": SAMPLE_EMPLOYEE_IDS[0], **OPEN_SESSION}),
+    QueryShape("unpaid sessions", "routes/employer.build_employee_snapshot", "attendance",
+               {"employee_id": {"$in": SAMPLE_EMPLOYEE_IDS}, "paid": False}),
+    QueryShape("payroll period", "routes/employer.build_payroll_lines", "attendance",
+               {"employee_id": {"$in": SAMPLE_EMPLOYEE_IDS}, "paid": False, "check_out": {"$ne": None},
+                "check_in": {"$gte": NOW - timedelta(days=14), "$lt": NOW}}),
+    QueryShape("employee history", "archive.iter_sessions", "attendance",
+               {"employee_id": SAMPLE_EMPLOYEE_IDS[0]}, {"check_in": 1}),
+    QueryShape("archived history", "archive.iter_sessions", "attendance_archive",
+               {"employee_id": SAMPLE_EMPLOYEE_IDS[0]}, {"check_in": 1}),
+    QueryShape("employer export", "exports.iter_session_batches", "attendance",
+               {"employer_id": SAMPLE_EMPLOYER_ID, "check_in": {"$gte": NOW - timedelta(days=30), "$lt": NOW}},
+               {"check_in": 1}),
+    QueryShape("stale open sessions", "sweeper.sweep_stale_sessions", "attendance",
+               {**OPEN_SESSION, "check_in": {"$lt": NOW - timedelta(hours=12)}}, {"check_in": 1}),
+    QueryShape("archivable sessions", "archive.archive_paid_sessions", "attendance",
+               {"paid": True, "check_out": {"$lt": NOW - timedelta(days=365)}}, {"check_out": 1}),
+    QueryShape("payroll run sessions", "routes/employer.reconcile_payroll_lines", "attendance",
+               {"payroll_run_id": ObjectId()}),
+    QueryShape("payroll run lookup", "routes/employer.run_payroll", "payroll_runs",
+               {"employer_id": SAMPLE_EMPLOYER_ID, "period_start": NOW - timedelta(days=14), "period_end": NOW}),
+    QueryShape("claim face job", "face_queue.MongoFaceQueue.claim", "face_jobs",
+               {"status": "pending"}, {"created_at": 1}),
+    QueryShape("rollup report", "routes/employer.attendance_report", "attendance_rollups",
+               {"employer_id": SAMPLE_EMPLOYER_ID, "granularity": "day",
+                "bucket_start": {"$gte": NOW - timedelta(days=365), "$lt": NOW}}),
+]
+
+
+async def seed(db):
+    """Fill the audit database with enough synthetic data for the planner to choose realistically."""
+    await client.drop_database(db.name)
+    rng = random.Random(42)
+
+    employer_ids = [SAMPLE_EMPLOYER_ID] + [str(ObjectId()) for _ in range(SEED_EMPLOYERS - 1)]
+    await db["employers"].insert_many([
+        {"_id": ObjectId(employer_id), "email": f"employer{i}@example.com", "face_encoding": [0.0] * 128}
+        for i, employer_id in enumerate(employer_ids)
+    ])
+
+    employees = []
+    for employer_index, employer_id in enumerate(employer_ids):
+        for i in range(SEED_EMPLOYEES_PER_EMPLOYER):
+            employee_id = SAMPLE_EMPLOYEE_IDS[i] if employer_index == 0 else str(ObjectId())
+            employees.append({
+                "_id": ObjectId(employee_id),
+                "email": f"employee{employer_index}_{i}@example.com",
+                "employer_id": employer_id,
+                "hourly_rate": 15.0,
+                "face_encoding": [0.0] * 128,
+            })
+    await db["employees"].insert_many(employees)
+
+    sessions = []
+    for employee in employees:
+        for day in range(SEED_SESSIONS_PER_EMPLOYEE):
+            check_in = NOW - timedelta(days=day * 7, hours=rng.randint(0, 12))
+            is_open = day == 0 and rng.random() < 0.2
+            sessions.append({
+                "employee_id": str(employee["_id"]),
+                "employer_id": employee["employer_id"],
+                "check_in": check_in,
+                "check_out": None if is_open else check_in + timedelta(hours=8),
+                "hours_worked": None if is_open else 8.0,
+                "earnings": None if is_open else 120.0,
+                "paid": day > 2,
+            })
+    await db["attendance"].insert_many(sessions)
+    print(f"🌱 Seeded {len(employer_ids)} employers, {len(employees)} employees, {len(sessions)} sessions")
+
+
+def plan_stages(plan: dict):
+    """All stage names in a winning plan tree."""
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(plan_stages(child))
+    return [stage for stage in stages if stage]
+
+
+def suggest_index(shape: QueryShape):
+    """Compound index following the equality, sort, range rule."""
+    equality, ranges = [], []
+    for key, value in shape.filter.items():
+        is_range = isinstance(value, dict) and not set(value) <= {"$in", "$eq", "$type"}
+        (ranges if is_range else equality).append(key)
+    keys = equality + [key for key in shape.sort if key not in equality] + [key for key in ranges if key not in shape.sort]
+    return [(key, 1) for key in keys]
+
+
+async def explain(db, shape: QueryShape):
+    command = {"find": shape.collection, "filter": shape.filter}
+    if shape.sort:
+        command["sort"] = shape.sort
+    result = await db.command({"explain": command, "verbosity": "executionStats"})
+    stats = result["executionStats"]
+    return plan_stages(result["queryPlanner"]["winningPlan"]), stats["totalDocsExamined"], stats["nReturned"]
+
+
+async def audit(db, max_ratio: float):
+    failures = 0
+    for shape in QUERY_SHAPES:
+        stages, examined, returned = await explain(db, shape)
+        ratio = examined / max(returned, 1)
+        problems = []
+        if "COLLSCAN" in stages and not shape.allow_collscan:
+            problems.append("COLLSCAN")
+        if ratio > max_ratio and not shape.allow_collscan:
+            problems.append(f"examined/returned {ratio:.1f} > {max_ratio}")
+        if "SORT" in stages:
+            problems.append("in-memory SORT")
+
+        status = "❌" if problems else "✅"
+        print(f"{status} {shape.collection}: {shape.name} ({shape.source}) "
+              f"stages={'>'.join(reversed(stages))} examined={examined} returned={returned}")
+        if problems:
+            failures += 1
+            print(f"   problems: {', '.join(problems)}")
+            print(f"   suggested index on {shape.collection}: {suggest_index(shape)}")
+
+    declared = sum(len(models) for models in INDEX_SPEC.values())
+    print(f"\n{len(QUERY_SHAPES)} query shapes audited against {declared} declared indexes, {failures} regressions")
+    return failures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Explain route query shapes and flag unindexed ones.")
+    parser.add_argument("--database", default=f"{DATABASE_NAME}_query_audit")
+    parser.add_argument("--seed", action="store_true", help="drop and reseed the audit database first")
+    parser.add_argument("--max-ratio", type=float, default=10.0, help="max docs examined per doc returned")
+    args = parser.parse_args()
+
+    if args.database == DATABASE_NAME:
+        sys.exit("❌ Refusing to audit the application database; pass a dedicated --database")
+
+    db = client[args.database]
+    if args.seed:
+        await seed(db)
+    await reconcile_indexes(db, rebuild_drifted=True)
+
+    failures = await audit(db, args.max_ratio)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
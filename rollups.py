@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+
+from database import (
+    attendance_collection,
+    attendance_archive_collection,
+    attendance_rollups_collection,
+    employees_collection
+)
+
+GRANULARITIES = ("day", "week", "month")
+
+
+def bucket_for(moment: datetime, granularity: str):
+    """Return the (bucket key, bucket start) a moment falls into for a granularity."""
+    day = datetime(moment.year, moment.month, moment.day)
+    if granularity == "day":
+        return f"day:{day:%Y-%m-%d}", day
+    if granularity == "week":
+        iso_year, iso_week, _ = day.isocalendar()
+        return f"week:{iso_year}-W{iso_week:02d}", day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return f"month:{day:%Y-%m}", datetime(day.year, day.month, 1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def split_session_by_day(check_in: datetime, check_out: datetime):
+    """Split a session into (day start, hours) slices so midnight crossings land in both days."""
+    slices = []
+    cursor = check_in
+    while cursor < check_out:
+        next_midnight = datetime(cursor.year, cursor.month, cursor.day) + timedelta(days=1)
+        end = min(next_midnight, check_out)
+        slices.append((cursor, (end - cursor).total_seconds() / 3600))
+        cursor = end
+    return slices
+
+
+def rollup_operations(employer_id: str, employee_id: str, session: dict):
+    """Build the upserts that add one closed session to every rollup bucket it touches."""
+    check_in = session["check_in"]
+    check_out = session["check_out"]
+    total_hours = (check_out - check_in).total_seconds() / 3600
+    earnings = session.get("earnings") or 0
+
+    totals = {}
+    for slice_start, hours in split_session_by_day(check_in, check_out):
+        # Earnings follow the hours, so a shift crossing midnight is costed to both days.
+        slice_earnings = earnings * hours / total_hours if total_hours else 0
+        for granularity in GRANULARITIES:
+            bucket, bucket_start = bucket_for(slice_start, granularity)
+            entry = totals.setdefault(bucket, {
+                "granularity": granularity,
+                "bucket_start": bucket_start,
+                "hours_worked": 0,
+                "earnings": 0,
+                "sessions": 0,
+            })
+            entry["hours_worked"] += hours
+            entry["earnings"] += slice_earnings
+
+    # A session is counted once per granularity, in the bucket where it started.
+    for granularity in GRANULARITIES:
+        totals[bucket_for(check_in, granularity)[0]]["sessions"] += 1
+
+    return [
+        UpdateOne(
+            {"employer_id": employer_id, "employee_id": employee_id, "bucket": bucket},
+            {
+                "$setOnInsert": {"granularity": entry["granularity"], "bucket_start": entry["bucket_start"]},
+                "$inc": {
+                    "hours_worked": entry["hours_worked"],
+                    "earnings": entry["earnings"],
+                    "sessions": entry["sessions"],
+                },
+            },
+            upsert=True
+        )
+        for bucket, entry in totals.items()
+    ]
+
+
+async def add_to_rollups(employer_id: str, employee_id: str, session: dict):
+    """Add a closed session to every rollup bucket; the caller must already own its rolled_up flag."""
+    operations = rollup_operations(employer_id, employee_id, session)
+    if operations:
+        await attendance_rollups_collection.bulk_write(operations, ordered=False)
+
+
+async def apply_session_to_rollups(employer_id: str, employee_id: str, session: dict,
+                                   collection=attendance_collection):
+    """Claim a closed session's rolled_up flag and add it to the rollups if this caller won the claim.
+
+    Claiming before counting means a concurrent backfill or checkout can never add
+    the same session twice; a crash in between leaves it uncounted instead.
+    """
+    claimed = await collection.find_one_and_update(
+        {"_id": session["_id"], "rolled_up": {"$ne": True}},
+        {"$set": {"rolled_up": True}},
+        projection={"_id": 1}
+    )
+    if claimed is None:
+        return False
+    await add_to_rollups(employer_id, employee_id, session)
+    return True
+
+
+async def backfill_rollups(batch_size: int = 1000):
+    """Roll up every closed session that has not been counted yet."""
+    employer_ids = {}
+    async for employee in employees_collection.find({}, {"employer_id": 1}):
+        employer_ids[str(employee["_id"])] = employee.get("employer_id")
+
+    processed = 0
+    # Archived history counts too, in case archive.py ran before the backfill.
+    for collection in (attendance_collection, attendance_archive_collection):
+        cursor = collection.find(
+            {"check_out": {"$ne": None}, "rolled_up": {"$ne": True}},
+            {"employee_id": 1, "check_in": 1, "check_out": 1, "earnings": 1}
+        ).batch_size(batch_size)
+
+        async for session in cursor:
+            employer_id = employer_ids.get(session["employee_id"])
+            if not employer_id:
+                continue
+            if not await apply_session_to_rollups(employer_id, session["employee_id"], session, collection):
+                continue
+            processed += 1
+            if processed % batch_size == 0:
+                print(f"🔄 Rolled up {processed} sessions...")
+
+    print(f"✅ Rollup backfill complete: {processed} sessions")
+    return processed
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill_rollups())
@@ -1,10 +1,15 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Header
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Header
 from datetime import datetime
 import numpy as np
 
-from database import attendance_collection, employees_collection
-from utils import get_face_encoding, compare_faces
-from auth import decode_token
+from database import attendance_collection, employees_collection, OPEN_SESSION, INTERACTIVE_MAX_TIME_MS
+from utils import compare_faces, ImageQualityError
+from face_queue import encode_upload
+from auth import decode_token, verify_face_claim
+from rollups import add_to_rollups
+from events import employer_channel, publish
+from idempotency import run_idempotent
+import metrics
 from bson import ObjectId
 
 router = APIRouter()
@@ -25,20 +30,37 @@ async def get_user_from_token(authorization: str):
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid user ID format")
 
-    user = await employees_collection.find_one({"_id": user_obj_id})
+    user = await employees_collection.find_one({"_id": user_obj_id}, max_time_ms=INTERACTIVE_MAX_TIME_MS)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     return user
 
 
-@router.post("/checkin")
-async def check_in(image: UploadFile = File(...), authorization: str = Header(None)):
-    user = await get_user_from_token(authorization)
+async def verify_employee_face(
+    user: dict,
+    image: UploadFile,
+    chip: UploadFile,
+    landmarks: str,
+    face_token: str,
+    device_id: str
+):
+    """Accept a recent face-login claim for this user and device, otherwise match the uploaded image."""
+    if face_token:
+        if verify_face_claim(face_token, str(user["_id"]), device_id):
+            metrics.increment("face_claim.accepted")
+            return
+        metrics.increment("face_claim.rejected")
+        if image is None and chip is None:
+            raise HTTPException(status_code=401, detail="Face verification expired or invalid; upload an image")
+
+    if image is None and chip is None:
+        raise HTTPException(status_code=400, detail="An image, a face chip or a face_token is required")
 
-    image_bytes = await image.read()
     try:
-        face_encoding = get_face_encoding(image_bytes)
+        face_encoding = await encode_upload(image, chip, landmarks)
+    except ImageQualityError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -49,46 +71,98 @@ async def check_in(image: UploadFile = File(...), authorization: str = Header(No
     if not match:
         raise HTTPException(status_code=401, detail="Face not recognized")
 
+
+async def with_idempotency(user: dict, action: str, idempotency_key: str, handler):
+    """Run a check-in/out handler, replaying the stored response when the client retries a key."""
+    if not idempotency_key:
+        return await handler()
+    return await run_idempotent(f"{user['_id']}:{action}:{idempotency_key}", handler)
+
+
+@router.post("/checkin")
+async def check_in(
+    image: UploadFile = File(None),
+    chip: UploadFile = File(None),
+    landmarks: str = Form(None),
+    face_token: str = Form(None),
+    authorization: str = Header(None),
+    idempotency_key: str = Header(None),
+    x_device_id: str = Header(None)
+):
+    user = await get_user_from_token(authorization)
+    return await with_idempotency(
+        user, "checkin", idempotency_key,
+        lambda: record_check_in(user, image, chip, landmarks, face_token, x_device_id)
+    )
+
+
+async def record_check_in(
+    user: dict,
+    image: UploadFile,
+    chip: UploadFile,
+    landmarks: str,
+    face_token: str,
+    device_id: str
+):
+    await verify_employee_face(user, image, chip, landmarks, face_token, device_id)
+
     existing = await attendance_collection.find_one({
         "employee_id": str(user["_id"]),
-        "check_out": None
-    })
+        **OPEN_SESSION
+    }, max_time_ms=INTERACTIVE_MAX_TIME_MS)
     if existing:
         raise HTTPException(status_code=400, detail="Already checked in")
 
     now = datetime.utcnow()
     await attendance_collection.insert_one({
         "employee_id": str(user["_id"]),
+        "employer_id": user.get("employer_id"),
         "check_in": now,
         "check_out": None,
         "hours_worked": None,
         "earnings": None,
         "paid": False
     })
+    await publish(employer_channel(user.get("employer_id")), {
+        "type": "status",
+        "employee_id": str(user["_id"]),
+        "status": "Working",
+        "last_check_in": now
+    })
     return {"message": "Check-in successful", "check_in": now}
 
 
 @router.post("/checkout")
-async def check_out(image: UploadFile = File(...), authorization: str = Header(None)):
+async def check_out(
+    image: UploadFile = File(None),
+    chip: UploadFile = File(None),
+    landmarks: str = Form(None),
+    face_token: str = Form(None),
+    authorization: str = Header(None),
+    idempotency_key: str = Header(None),
+    x_device_id: str = Header(None)
+):
     user = await get_user_from_token(authorization)
+    return await with_idempotency(
+        user, "checkout", idempotency_key,
+        lambda: record_check_out(user, image, chip, landmarks, face_token, x_device_id)
+    )
 
-    image_bytes = await image.read()
-    try:
-        face_encoding = get_face_encoding(image_bytes)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-
-    face_encoding = np.array(face_encoding, dtype=np.float64)
-    stored_encoding = np.array(user["face_encoding"], dtype=np.float64)
 
-    match = compare_faces([stored_encoding], face_encoding, tolerance=0.65)
-    if not match:
-        raise HTTPException(status_code=401, detail="Face not recognized")
+async def record_check_out(
+    user: dict,
+    image: UploadFile,
+    chip: UploadFile,
+    landmarks: str,
+    face_token: str,
+    device_id: str
+):
+    await verify_employee_face(user, image, chip, landmarks, face_token, device_id)
 
     session = await attendance_collection.find_one({
         "employee_id": str(user["_id"]),
-        "check_out": None
-    })
+        **OPEN_SESSION
+    }, max_time_ms=INTERACTIVE_MAX_TIME_MS)
     if not session:
         raise HTTPException(status_code=404, detail="No active check-in found")
 
@@ -98,15 +172,30 @@ async def check_out(image: UploadFile = File(...), authorization: str = Header(N
     rate = user.get("hourly_rate", 0)
     earnings = round(hours * rate, 2)
 
-    await attendance_collection.update_one(
-        {"_id": session["_id"]},
+    # Guard on the open state so a session the sweeper closed meanwhile is not
+    # overwritten, rolled up twice or published twice.
+    result = await attendance_collection.update_one(
+        {"_id": session["_id"], **OPEN_SESSION},
         {"$set": {
             "check_out": check_out_time,
             "hours_worked": round(hours, 2),
             "earnings": earnings,
-            "paid": False
+            "paid": False,
+            "rolled_up": True
         }}
     )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=409, detail="Session was already checked out")
+
+    session.update({"check_out": check_out_time, "earnings": earnings})
+    await add_to_rollups(user.get("employer_id"), str(user["_id"]), session)
+    await publish(employer_channel(user.get("employer_id")), {
+        "type": "earnings",
+        "employee_id": str(user["_id"]),
+        "status": "Not Working",
+        "last_check_in": None,
+        "earnings_delta": earnings
+    })
 
     return {
         "message": "Check-out successful",
@@ -1,11 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, Form, File
 from bson import ObjectId
-from database import employees_collection, employers_collection, attendance_collection
+from database import employees_collection, employers_collection
 from auth import get_current_user
-from utils import hash_password, get_face_encoding
+from utils import hash_password, ImageQualityError
+from face_queue import encode_upload
+from archive import iter_sessions
+from identity import register_identities
 import numpy as np
 
 router = APIRouter()
+# Routes that run the face pipeline; only mounted on workers serving the face role.
+face_router = APIRouter()
 
 # Get employee details route
 @router.get("/details")
@@ -30,23 +35,25 @@ async def get_employee_details(current_user: dict = Depends(get_current_user)):
     }
 
 # Employee registration route
-@router.post("/register", status_code=201)
+@face_router.post("/register", status_code=201)
 async def register_employee(
     username: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
     employer_id: str = Form(...),
     hourly_rate: float = Form(...),
-    image: UploadFile = File(...)
+    image: UploadFile = File(None),
+    chip: UploadFile = File(None),
+    landmarks: str = Form(None)
 ):
     existing_user = await employees_collection.find_one({"email": email})
     if existing_user:
         raise HTTPException(status_code=400, detail="Employee already exists")
 
-    image_bytes = await image.read()
-
     try:
-        face_encoding = get_face_encoding(image_bytes)
+        face_encoding = await encode_upload(image, chip, landmarks)
+    except ImageQualityError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
 
@@ -62,6 +69,7 @@ async def register_employee(
     }
 
     new_employee = await employees_collection.insert_one(employee_data)
+    await register_identities("employee", [employee_data])
     return {"message": "Employee registered successfully", "id": str(new_employee.inserted_id)}
 
 # New route for employee to see attendance summary
@@ -71,7 +79,7 @@ async def attendance_summary(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Access forbidden")
 
     employee_id = str(current_user["id"])
-    attendance_cursor = attendance_collection.find({"employee_id": employee_id})
+    attendance_cursor = iter_sessions({"employee_id": employee_id})
 
     total_hours = 0
     total_earnings = 0
@@ -104,7 +112,7 @@ async def attendance_history(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Access forbidden")
 
     employee_id = str(current_user["id"])
-    cursor = attendance_collection.find({"employee_id": employee_id})
+    cursor = iter_sessions({"employee_id": employee_id})
     history = []
 
     async for record in cursor:
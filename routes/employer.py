@@ -1,29 +1,59 @@
-from fastapi import APIRouter, HTTPException, UploadFile, Form, File, Depends, Header
-from database import employers_collection, employees_collection, attendance_collection
-from utils import hash_password, get_face_encoding, compare_faces
+from fastapi import APIRouter, HTTPException, UploadFile, Form, File, Depends, Header, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from database import (
+    employers_collection,
+    employees_collection,
+    attendance_collection,
+    payroll_runs_collection,
+    attendance_rollups_collection,
+    for_reporting,
+    REPORTING_MAX_TIME_MS
+)
+from rollups import GRANULARITIES
+from exports import stream_csv, stream_parquet, parquet_available
+from events import employer_channel, publish, subscribe
+from onboarding import onboard_employees
+from identity import register_identities
+from utils import hash_password, compare_faces, ImageQualityError
+from face_queue import encode_upload
 from auth import get_current_user
 from bson import ObjectId
+from datetime import datetime
+from pymongo import UpdateMany
+from pymongo.errors import DuplicateKeyError
 import numpy as np
+import asyncio
+import json
+import tarfile
+import zipfile
 
 router = APIRouter()
+# Routes that run the face pipeline; only mounted on workers serving the face role.
+face_router = APIRouter()
+
+DASHBOARD_KEEPALIVE_SECONDS = 15
 
 # --------------------
 # POST /register
 # --------------------
-@router.post("/register", status_code=201)
+@face_router.post("/register", status_code=201)
 async def register_employer(
     username: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
-    image: UploadFile = File(...)
+    image: UploadFile = File(None),
+    chip: UploadFile = File(None),
+    landmarks: str = Form(None)
 ):
     existing_user = await employers_collection.find_one({"email": email})
     if existing_user:
         raise HTTPException(status_code=400, detail="Employer already exists")
 
-    image_bytes = await image.read()
     try:
-        face_encoding = get_face_encoding(image_bytes)
+        face_encoding = await encode_upload(image, chip, landmarks)
+    except ImageQualityError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
 
@@ -41,8 +71,33 @@ async def register_employer(
     }
 
     new_employer = await employers_collection.insert_one(employer_data)
+    await register_identities("employer", [employer_data])
     return {"message": "Employer registered successfully", "id": str(new_employer.inserted_id)}
 
+# --------------------
+# POST /employees/bulk
+# --------------------
+@face_router.post("/employees/bulk")
+async def bulk_register_employees(
+    details: UploadFile = File(...),
+    archive: UploadFile = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["type"] != "employer":
+        raise HTTPException(status_code=403, detail="Only employers can onboard employees")
+
+    archive_name = archive.filename or ""
+    if not archive_name.lower().endswith((".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+        raise HTTPException(status_code=400, detail="archive must be a zip or tar file")
+
+    try:
+        report = await onboard_employees(current_user["id"], details.file, archive.file, archive_name)
+    except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+        raise HTTPException(status_code=400, detail=f"Error reading upload: {str(e)}")
+
+    created = sum(1 for entry in report if entry["status"] == "created")
+    return {"message": f"{created} of {len(report)} employees registered", "report": report}
+
 # --------------------
 # GET /details
 # --------------------
@@ -62,51 +117,144 @@ async def get_employer_details(current_user: dict = Depends(get_current_user)):
     }
 
 # --------------------
-# GET /employees
+# PUT /settings
 # --------------------
-@router.get("/employees")
-async def get_employees(current_user: dict = Depends(get_current_user)):
+@router.put("/settings")
+async def update_employer_settings(
+    max_session_hours: float = Form(...),
+    current_user: dict = Depends(get_current_user)
+):
     if current_user["type"] != "employer":
         raise HTTPException(status_code=403, detail="Access forbidden")
 
-    cursor = employees_collection.find({"employer_id": current_user["id"]})
-    employees = []
+    if max_session_hours <= 0 or max_session_hours > 24:
+        raise HTTPException(status_code=400, detail="max_session_hours must be between 0 and 24")
 
-    async for employee in cursor:
-        employee_id = str(employee["_id"])
+    await employers_collection.update_one(
+        {"_id": ObjectId(current_user["id"])},
+        {"$set": {"max_session_hours": max_session_hours}}
+    )
+    return {"message": "Settings updated", "max_session_hours": max_session_hours}
 
-        # Fetch unpaid attendance records only
-        attendance_cursor = attendance_collection.find({
-            "employee_id": employee_id,
-            "paid": False  # ✅ Only unpaid sessions counted
-        })
+# --------------------
+# GET /employees
+# --------------------
+async def build_employee_snapshot(employer_id: str):
+    """Status and unpaid earnings of every employee, from one aggregation over unpaid sessions."""
+    employees = [
+        employee async for employee in for_reporting(employees_collection).find(
+            {"employer_id": employer_id}, max_time_ms=REPORTING_MAX_TIME_MS
+        )
+    ]
+    employee_ids = [str(employee["_id"]) for employee in employees]
 
-        total_earnings = 0
-        last_check_in = None
-        is_working = False
+    totals = {}
+    pipeline = [
+        {"$match": {"employee_id": {"$in": employee_ids}, "paid": False}},  # ✅ Only unpaid sessions counted
+        {"$group": {
+            "_id": "$employee_id",
+            "total_earnings": {"$sum": {"$ifNull": ["$earnings", 0]}},
+            "open_check_in": {"$max": {"$cond": [{"$eq": ["$check_out", None]}, "$check_in", None]}},
+        }},
+    ]
+    async for row in for_reporting(attendance_collection).aggregate(pipeline, maxTimeMS=REPORTING_MAX_TIME_MS):
+        totals[row["_id"]] = row
 
-        async for record in attendance_cursor:
-            if record.get("earnings"):
-                total_earnings += record["earnings"]
-            if record.get("check_in") and not record.get("check_out"):
-                is_working = True
-                last_check_in = record.get("check_in")
+    snapshot = []
+    for employee in employees:
+        employee_id = str(employee["_id"])
+        row = totals.get(employee_id, {})
+        last_check_in = row.get("open_check_in")
 
-        employees.append({
+        snapshot.append({
             "id": employee_id,
             "username": employee["username"],
             "email": employee["email"],
             "hourly_rate": employee["hourly_rate"],
-            "status": "Working" if is_working else "Not Working",
+            "status": "Working" if last_check_in else "Not Working",
             "last_check_in": last_check_in,
-            "total_unpaid_earnings": round(total_earnings, 2)  # ✅ Clear that these are unpaid
+            "total_unpaid_earnings": round(row.get("total_earnings", 0), 2)  # ✅ Clear that these are unpaid
         })
 
-    return employees
+    return snapshot
+
+
+@router.get("/employees")
+async def get_employees(current_user: dict = Depends(get_current_user)):
+    if current_user["type"] != "employer":
+        raise HTTPException(status_code=403, detail="Access forbidden")
+
+    return await build_employee_snapshot(current_user["id"])
+
+# --------------------
+# GET /dashboard/stream
+# --------------------
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+@router.get("/dashboard/stream")
+async def dashboard_stream(
+    request: Request,
+    token: str = Query(None),
+    authorization: str = Header(None)
+):
+    # EventSource cannot send headers, so the token may also come as a query parameter.
+    if not token and authorization and authorization.startswith("Bearer "):
+        token = authorization.split(" ")[1]
+    if not token:
+        raise HTTPException(status_code=403, detail="Invalid or missing authorization token")
+
+    current_user = await get_current_user(token)
+    if current_user["type"] != "employer":
+        raise HTTPException(status_code=403, detail="Access forbidden")
+
+    employer_id = current_user["id"]
+
+    async def event_stream():
+        async with subscribe(employer_channel(employer_id)) as queue:
+            # Subscribe before snapshotting so no event between the two is lost.
+            yield format_sse("snapshot", await build_employee_snapshot(employer_id))
+
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=DASHBOARD_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+
+                if event["type"] == "resync":
+                    yield format_sse("snapshot", await build_employee_snapshot(employer_id))
+                else:
+                    yield format_sse(event["type"], event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # --------------------
 # POST /pay_employee/{employee_id}
 # --------------------
+async def publish_payments(employer_id: str, employee_ids: list):
+    """Send each paid employee's remaining unpaid earnings, the one shape every payment event uses."""
+    totals = {employee_id: 0 for employee_id in employee_ids}
+    pipeline = [
+        {"$match": {"employee_id": {"$in": employee_ids}, "paid": False}},
+        {"$group": {"_id": "$employee_id", "total_earnings": {"$sum": {"$ifNull": ["$earnings", 0]}}}},
+    ]
+    async for row in attendance_collection.aggregate(pipeline):
+        totals[row["_id"]] = row["total_earnings"]
+
+    for employee_id, total in totals.items():
+        await publish(employer_channel(employer_id), {
+            "type": "payment",
+            "employee_id": employee_id,
+            "total_unpaid_earnings": round(total, 2)
+        })
+
+
 @router.post("/pay_employee/{employee_id}")
 async def pay_employee(employee_id: str, authorization: str = Header(None)):
     if not authorization:
@@ -121,5 +269,304 @@ async def pay_employee(employee_id: str, authorization: str = Header(None)):
         {"employee_id": employee_id, "paid": False},
         {"$set": {"paid": True}}
     )
+    if result.modified_count:
+        await publish_payments(current_user["id"], [employee_id])
 
     return {"message": f"{result.modified_count} sessions marked as paid."}
+
+
+# --------------------
+# POST /payroll/run
+# --------------------
+def serialize_payroll_lines(lines: list):
+    return [
+        {
+            "employee_id": line["employee_id"],
+            "username": line["username"],
+            "hourly_rate": line["hourly_rate"],
+            "sessions": len(line["session_ids"]),
+            "hours_worked": line["hours_worked"],
+            "earnings": line["earnings"],
+        }
+        for line in lines
+    ]
+
+
+def serialize_payroll_run(run: dict):
+    """Convert a stored payroll run into a JSON-friendly response.
+
+    ``employees`` and the totals are the snapshot computed when the run was
+    created; the ``settled_`` fields are what completing the run actually paid.
+    """
+    settled_lines = run.get("settled_lines")
+    return {
+        "id": str(run["_id"]),
+        "employer_id": run["employer_id"],
+        "period_start": run["period_start"],
+        "period_end": run["period_end"],
+        "status": run["status"],
+        "created_at": run["created_at"],
+        "completed_at": run.get("completed_at"),
+        "total_hours": run["total_hours"],
+        "total_earnings": run["total_earnings"],
+        "employees": serialize_payroll_lines(run["lines"]),
+        "settled_total_hours": run.get("settled_total_hours"),
+        "settled_total_earnings": run.get("settled_total_earnings"),
+        "settled_employees": serialize_payroll_lines(settled_lines) if settled_lines is not None else None,
+    }
+
+
+async def build_payroll_lines(employer_id: str, period_start: datetime, period_end: datetime):
+    """Aggregate unpaid, closed sessions of every employee of an employer for a period."""
+    employees = {}
+    async for employee in employees_collection.find(
+        {"employer_id": employer_id},
+        {"username": 1, "hourly_rate": 1}
+    ):
+        employees[str(employee["_id"])] = employee
+
+    if not employees:
+        return []
+
+    pipeline = [
+        {"$match": {
+            "employee_id": {"$in": list(employees.keys())},
+            "paid": False,
+            "check_out": {"$ne": None},
+            "check_in": {"$gte": period_start, "$lt": period_end},
+        }},
+        {"$group": {
+            "_id": "$employee_id",
+            "hours_worked": {"$sum": {"$ifNull": ["$hours_worked", 0]}},
+            "earnings": {"$sum": {"$ifNull": ["$earnings", 0]}},
+            "session_ids": {"$push": "$_id"},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+    lines = []
+    async for row in attendance_collection.aggregate(pipeline):
+        employee = employees[row["_id"]]
+        lines.append({
+            "employee_id": row["_id"],
+            "username": employee.get("username"),
+            "hourly_rate": employee.get("hourly_rate"),
+            "session_ids": row["session_ids"],
+            "hours_worked": round(row["hours_worked"], 2),
+            "earnings": round(row["earnings"], 2),
+        })
+    return lines
+
+
+async def reconcile_payroll_lines(run: dict):
+    """Rebuild a run's lines from the sessions it actually marked as paid."""
+    snapshot = {line["employee_id"]: line for line in run["lines"]}
+    pipeline = [
+        {"$match": {"payroll_run_id": run["_id"]}},
+        {"$group": {
+            "_id": "$employee_id",
+            "hours_worked": {"$sum": {"$ifNull": ["$hours_worked", 0]}},
+            "earnings": {"$sum": {"$ifNull": ["$earnings", 0]}},
+            "session_ids": {"$push": "$_id"},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+    lines = []
+    async for row in attendance_collection.aggregate(pipeline):
+        line = snapshot.get(row["_id"], {})
+        lines.append({
+            "employee_id": row["_id"],
+            "username": line.get("username"),
+            "hourly_rate": line.get("hourly_rate"),
+            "session_ids": row["session_ids"],
+            "hours_worked": round(row["hours_worked"], 2),
+            "earnings": round(row["earnings"], 2),
+        })
+    return lines
+
+
+async def settle_payroll_run(run: dict):
+    """Mark every session covered by a payroll snapshot as paid.
+
+    Each operation only touches sessions that are still unpaid, so re-running it
+    after a crash settles whatever was left and never double-pays. The snapshot
+    itself is never rewritten: what the run actually paid, which leaves out
+    sessions paid meanwhile by another run or by pay_employee, is stored next to
+    it as settled_lines and settled totals.
+    """
+    operations = [
+        UpdateMany(
+            {"_id": {"$in": line["session_ids"]}, "paid": False},
+            {"$set": {"paid": True, "payroll_run_id": run["_id"]}}
+        )
+        for line in run["lines"]
+    ]
+    if operations:
+        await attendance_collection.bulk_write(operations, ordered=False)
+
+    lines = await reconcile_payroll_lines(run)
+    expected = sum(len(line["session_ids"]) for line in run["lines"])
+    settled = sum(len(line["session_ids"]) for line in lines)
+    if settled != expected:
+        print(f"⚠️ Payroll run {run['_id']} settled {settled} of {expected} sessions; "
+              f"the rest were already paid elsewhere")
+
+    completed = {
+        "status": "completed",
+        "completed_at": datetime.utcnow(),
+        "settled_lines": lines,
+        "settled_total_hours": round(sum(line["hours_worked"] for line in lines), 2),
+        "settled_total_earnings": round(sum(line["earnings"] for line in lines), 2),
+    }
+    await payroll_runs_collection.update_one(
+        {"_id": run["_id"], "status": "pending"},
+        {"$set": completed}
+    )
+    run.update(completed)
+    return run
+
+
+@router.post("/payroll/run")
+async def run_payroll(
+    period_start: datetime = Form(...),
+    period_end: datetime = Form(...),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["type"] != "employer":
+        raise HTTPException(status_code=403, detail="Only employers can run payroll")
+
+    if period_start >= period_end:
+        raise HTTPException(status_code=400, detail="period_start must be before period_end")
+
+    employer_id = current_user["id"]
+    period = {"employer_id": employer_id, "period_start": period_start, "period_end": period_end}
+
+    # A run that already exists for this period is resumed instead of recomputed,
+    # so the stored snapshot stays the single source of truth for what was paid.
+    run = await payroll_runs_collection.find_one(period)
+    if run and run["status"] == "completed":
+        return {"message": "Payroll already completed for this period", "run": serialize_payroll_run(run)}
+
+    if not run:
+        lines = await build_payroll_lines(employer_id, period_start, period_end)
+        run = {
+            **period,
+            "status": "pending",
+            "created_at": datetime.utcnow(),
+            "total_hours": round(sum(line["hours_worked"] for line in lines), 2),
+            "total_earnings": round(sum(line["earnings"] for line in lines), 2),
+            "lines": lines,
+        }
+        try:
+            result = await payroll_runs_collection.insert_one(run)
+            run["_id"] = result.inserted_id
+        except DuplicateKeyError:
+            # A concurrent request created the snapshot first; settle that one.
+            run = await payroll_runs_collection.find_one(period)
+
+    run = await settle_payroll_run(run)
+    if run["settled_lines"]:
+        await publish_payments(employer_id, [line["employee_id"] for line in run["settled_lines"]])
+    return {"message": "Payroll run completed", "run": serialize_payroll_run(run)}
+
+
+# --------------------
+# GET /payroll/runs
+# --------------------
+@router.get("/payroll/runs")
+async def list_payroll_runs(current_user: dict = Depends(get_current_user)):
+    if current_user["type"] != "employer":
+        raise HTTPException(status_code=403, detail="Access forbidden")
+
+    cursor = for_reporting(payroll_runs_collection).find(
+        {"employer_id": current_user["id"]}, max_time_ms=REPORTING_MAX_TIME_MS
+    ).sort("period_start", -1)
+    return [serialize_payroll_run(run) async for run in cursor]
+
+
+# --------------------
+# GET /reports/attendance
+# --------------------
+@router.get("/reports/attendance")
+async def attendance_report(
+    granularity: str = Query("day"),
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    employee_id: str = Query(None),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["type"] != "employer":
+        raise HTTPException(status_code=403, detail="Access forbidden")
+
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+    match = {
+        "employer_id": current_user["id"],
+        "granularity": granularity,
+        "bucket_start": {"$gte": start, "$lt": end},
+    }
+    if employee_id:
+        match["employee_id"] = employee_id
+
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": "$bucket_start",
+            "bucket": {"$first": "$bucket"},
+            "hours_worked": {"$sum": "$hours_worked"},
+            "earnings": {"$sum": "$earnings"},
+            "sessions": {"$sum": "$sessions"},
+            "employees": {"$addToSet": "$employee_id"},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+    report = []
+    async for row in for_reporting(attendance_rollups_collection).aggregate(
+        pipeline, maxTimeMS=REPORTING_MAX_TIME_MS
+    ):
+        report.append({
+            "bucket": row["bucket"].split(":", 1)[1],
+            "bucket_start": row["_id"],
+            "hours_worked": round(row["hours_worked"], 2),
+            "earnings": round(row["earnings"], 2),
+            "sessions": row["sessions"],
+            "employees": len(row["employees"]),
+        })
+    return report
+
+
+# --------------------
+# GET /attendance/export
+# --------------------
+@router.get("/attendance/export")
+async def export_attendance(
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    format: str = Query("csv"),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["type"] != "employer":
+        raise HTTPException(status_code=403, detail="Access forbidden")
+
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    filename = f"attendance_{start:%Y%m%d}_{end:%Y%m%d}"
+    if format == "csv":
+        return StreamingResponse(
+            stream_csv(current_user["id"], start, end),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'}
+        )
+    if format == "parquet":
+        if not parquet_available():
+            raise HTTPException(status_code=501, detail="Parquet export requires pyarrow to be installed")
+        return StreamingResponse(
+            stream_parquet(current_user["id"], start, end),
+            media_type="application/vnd.apache.parquet",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.parquet"'}
+        )
+    raise HTTPException(status_code=400, detail="format must be csv or parquet")
@@ -0,0 +1,171 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from database import (
+    attendance_collection,
+    attendance_rollups_collection,
+    employees_collection,
+    employers_collection,
+    OPEN_SESSION
+)
+from events import employer_channel, publish
+from locks import acquire_lease, release_lease
+from rollups import rollup_operations
+import metrics
+
+AUTO_CHECKOUT_ENABLED = os.getenv("AUTO_CHECKOUT_ENABLED", "true").lower() == "true"
+AUTO_CHECKOUT_INTERVAL_SECONDS = int(os.getenv("AUTO_CHECKOUT_INTERVAL_SECONDS", "300"))
+DEFAULT_MAX_SESSION_HOURS = float(os.getenv("AUTO_CHECKOUT_MAX_SESSION_HOURS", "12"))
+SWEEP_PAGE_SIZE = 500
+LEASE_NAME = "auto_checkout_sweeper"
+
+
+async def load_session_limits():
+    """Max session hours per employer that overrides the default."""
+    limits = {}
+    async for employer in employers_collection.find(
+        {"max_session_hours": {"$exists": True}},
+        {"max_session_hours": 1}
+    ):
+        limits[str(employer["_id"])] = employer["max_session_hours"]
+    return limits
+
+
+async def close_page(sessions: list, limits: dict, now: datetime):
+    """Close one page of stale sessions with a single bulk_write per collection."""
+    employee_ids = list({session["employee_id"] for session in sessions})
+    employees = {}
+    async for employee in employees_collection.find(
+        {"_id": {"$in": [ObjectId(employee_id) for employee_id in employee_ids if ObjectId.is_valid(employee_id)]}},
+        {"hourly_rate": 1, "employer_id": 1}
+    ):
+        employees[str(employee["_id"])] = employee
+
+    attendance_ops = []
+    rollup_ops = []
+    closed = []
+    for session in sessions:
+        employee = employees.get(session["employee_id"], {})
+        employer_id = session.get("employer_id") or employee.get("employer_id")
+        limit_hours = limits.get(employer_id, DEFAULT_MAX_SESSION_HOURS)
+        if session["check_in"] > now - timedelta(hours=limit_hours):
+            continue
+
+        check_out_time = session["check_in"] + timedelta(hours=limit_hours)
+        hours = round(limit_hours, 2)
+        earnings = round(limit_hours * employee.get("hourly_rate", 0), 2)
+
+        # Guard on the open state so a real check-out that raced the sweep wins.
+        attendance_ops.append(UpdateOne(
+            {"_id": session["_id"], **OPEN_SESSION},
+            {"$set": {
+                "check_out": check_out_time,
+                "hours_worked": hours,
+                "earnings": earnings,
+                "paid": False,
+                "auto_checked_out": True,
+                "rolled_up": True
+            }}
+        ))
+        closed_session = {**session, "check_out": check_out_time, "earnings": earnings}
+        closed.append((employer_id, closed_session))
+
+    if not attendance_ops:
+        return 0
+
+    result = await attendance_collection.bulk_write(attendance_ops, ordered=False)
+    if result.modified_count != len(attendance_ops):
+        # Some sessions were checked out while this page was being built; only roll up
+        # the ones this sweep actually closed.
+        still_ours = set()
+        async for session in attendance_collection.find(
+            {"_id": {"$in": [session["_id"] for _, session in closed]}, "auto_checked_out": True},
+            {"_id": 1}
+        ):
+            still_ours.add(session["_id"])
+        closed = [(employer_id, session) for employer_id, session in closed if session["_id"] in still_ours]
+
+    for employer_id, session in closed:
+        rollup_ops.extend(rollup_operations(employer_id, session["employee_id"], session))
+    if rollup_ops:
+        await attendance_rollups_collection.bulk_write(rollup_ops, ordered=False)
+
+    for employer_id, session in closed:
+        await publish(employer_channel(employer_id), {
+            "type": "earnings",
+            "employee_id": session["employee_id"],
+            "status": "Not Working",
+            "last_check_in": None,
+            "earnings_delta": session["earnings"],
+            "auto_checked_out": True
+        })
+
+    return len(closed)
+
+
+async def sweep_stale_sessions(now: datetime = None):
+    """Close every open session that has run past its employer's limit."""
+    now = now or datetime.utcnow()
+    limits = await load_session_limits()
+    shortest = min([DEFAULT_MAX_SESSION_HOURS, *limits.values()])
+
+    cursor = attendance_collection.find(
+        {**OPEN_SESSION, "check_in": {"$lt": now - timedelta(hours=shortest)}},
+        {"employee_id": 1, "employer_id": 1, "check_in": 1}
+    ).sort("check_in", 1).batch_size(SWEEP_PAGE_SIZE)
+
+    closed = 0
+    page = []
+    async for session in cursor:
+        page.append(session)
+        if len(page) >= SWEEP_PAGE_SIZE:
+            closed += await close_page(page, limits, now)
+            page = []
+    if page:
+        closed += await close_page(page, limits, now)
+
+    metrics.increment("auto_checkout.runs")
+    metrics.increment("auto_checkout.sessions_closed", closed)
+    metrics.set_gauge("auto_checkout.last_run_closed", closed)
+    metrics.set_gauge("auto_checkout.last_run_at", now.timestamp())
+    if closed:
+        print(f"🧹 Auto-checkout closed {closed} stale sessions")
+    return closed
+
+
+async def run_sweeper():
+    """Sweep on a fixed interval, but only on the worker holding the leader lease."""
+    while True:
+        try:
+            if await acquire_lease(LEASE_NAME, AUTO_CHECKOUT_INTERVAL_SECONDS * 2):
+                await sweep_stale_sessions()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.increment("auto_checkout.errors")
+            print(f"❌ Auto-checkout sweep failed: {e}")
+        await asyncio.sleep(AUTO_CHECKOUT_INTERVAL_SECONDS)
+
+
+def start_sweeper():
+    if not AUTO_CHECKOUT_ENABLED:
+        return None
+    return asyncio.create_task(run_sweeper())
+
+
+async def stop_sweeper(task):
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await release_lease(LEASE_NAME)
+
+
+if __name__ == "__main__":
+    asyncio.run(sweep_stale_sessions())
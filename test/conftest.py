@@ -0,0 +1,15 @@
+import os
+import sys
+
+# Unit tests import the app modules from the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Manual scripts that need a webcam and a running server.
+collect_ignore = [
+    "attendance-test.py",
+    "test_employee_login.py",
+    "test_employee_register.py",
+    "test_employer_login.py",
+    "test_employer_register.py",
+    "test_mongo.py",
+]
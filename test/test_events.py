@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+import events
+from events import MongoBroker
+
+CHANNEL = "employer:1"
+
+
+class FakeCappedCollection:
+    """Documents in insertion (natural) order; every cursor ends after the current contents."""
+
+    def __init__(self):
+        self.documents = []
+
+    def _matching(self, query):
+        bound = query.get("_id", {}).get("$gte")
+        return [document for document in self.documents if bound is None or document["_id"] >= bound]
+
+    async def find_one(self, query, projection=None, sort=None):
+        return self.documents[-1] if self.documents else None
+
+    async def _iterate(self, documents):
+        for document in documents:
+            yield document
+
+    def find(self, query, projection=None, cursor_type=None):
+        return self._iterate(self._matching(query))
+
+
+def event_id(moment, tail: bytes):
+    """An ObjectId with a chosen timestamp and per-process suffix."""
+    return ObjectId(ObjectId.from_datetime(moment).binary[:4] + tail)
+
+
+def insert(collection, _id, name):
+    collection.documents.append({"_id": _id, "channel": CHANNEL, "event": {"type": "status", "name": name}})
+
+
+async def next_name(queue):
+    return (await asyncio.wait_for(queue.get(), 1))["name"]
+
+
+def test_reopened_tail_delivers_same_second_events_from_other_workers(monkeypatch):
+    monkeypatch.setattr(events, "TAIL_RETRY_SECONDS", 0.01)
+    second = datetime(2026, 10, 19, 12, 0, 0, tzinfo=timezone.utc)
+    collection = FakeCappedCollection()
+    insert(collection, event_id(second, b"\x10" * 8), "before-start")
+
+    async def scenario():
+        broker = MongoBroker(collection)
+        async with broker.subscribe(CHANNEL) as queue:
+            await asyncio.sleep(0.05)
+            # Worker with a high random suffix publishes first...
+            insert(collection, event_id(second, b"\xff" * 8), "from-worker-a")
+            first = await next_name(queue)
+            # ...then one with a lower suffix in the same second, after the cursor reopened.
+            insert(collection, event_id(second, b"\x01" * 8), "from-worker-b")
+            second_name = await next_name(queue)
+            await asyncio.sleep(0.05)
+            leftover = queue.qsize()
+        await broker.close()
+        return first, second_name, leftover
+
+    first, second_name, leftover = asyncio.run(scenario())
+    assert (first, second_name) == ("from-worker-a", "from-worker-b")
+    # Neither the event from before start nor anything re-read in the overlap is delivered again.
+    assert leftover == 0
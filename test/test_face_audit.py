@@ -0,0 +1,63 @@
+import csv
+import io
+
+import numpy as np
+import pytest
+
+import face_audit
+from face_audit import compare_tile, iter_tiles, run_audit
+
+
+@pytest.fixture
+def encodings(tmp_path):
+    rng = np.random.default_rng(7)
+    matrix = rng.normal(0, 0.3, (300, face_audit.ENCODING_SIZE)).astype(np.float32)
+    # Plant near-duplicates inside one tile and across tiles.
+    for source, copy in ((3, 10), (5, 250), (120, 299)):
+        matrix[copy] = matrix[source] + 0.001
+    path = tmp_path / "encodings.npy"
+    np.save(path, matrix)
+    face_audit._open_encodings(str(path))
+    return matrix
+
+
+def brute_force_pairs(matrix, tolerance):
+    distances = np.linalg.norm(matrix[:, None, :] - matrix[None, :, :], axis=2)
+    rows, cols = np.nonzero(np.triu(distances <= tolerance, k=1))
+    return set(zip(rows.tolist(), cols.tolist()))
+
+
+def test_tiles_cover_every_pair_once():
+    covered = []
+    for rows, cols in iter_tiles(10, 4):
+        covered.extend((i, j) for i in range(*rows) for j in range(*cols) if i < j)
+    assert sorted(covered) == [(i, j) for i in range(10) for j in range(i + 1, 10)]
+
+
+def test_tiled_pairs_match_brute_force(encodings):
+    tolerance = 0.6
+    found = {}
+    for rows, cols in iter_tiles(len(encodings), 64):
+        for row, col, distance in compare_tile(rows, cols, tolerance):
+            found[(row, col)] = distance
+
+    assert set(found) == brute_force_pairs(encodings, tolerance)
+    assert {(3, 10), (5, 250), (120, 299)} <= set(found)
+    assert found[(3, 10)] == pytest.approx(np.linalg.norm(encodings[3] - encodings[10]), abs=1e-3)
+
+
+def test_diagonal_tile_skips_self_pairs(encodings):
+    assert all(row < col for row, col, _ in compare_tile((0, 64), (0, 64), 0.6))
+
+
+def test_run_audit_writes_pairs_with_owners(encodings):
+    owners = [("employee", f"user{i}", f"employer{i % 2}") for i in range(len(encodings))]
+    output = io.StringIO()
+
+    matches = run_audit(owners, encodings, output, tolerance=0.6, tile_size=64, processes=2)
+
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert matches == len(rows) == len(brute_force_pairs(encodings, 0.6))
+    pair = next(row for row in rows if {row["user_id_a"], row["user_id_b"]} == {"user3", "user10"})
+    assert pair["employer_id_a"] == "employer1" and pair["employer_id_b"] == "employer0"
+    assert pair["same_employer"] == "False"
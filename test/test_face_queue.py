@@ -0,0 +1,130 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+import face_queue
+import face_worker
+import metrics
+from face_queue import InProcessFaceQueue, run_face_job, set_transport
+from utils import ImageQualityError
+
+ENCODING = [0.5] * 128
+
+
+@pytest.fixture(autouse=True)
+def in_process_queue(monkeypatch):
+    transport = InProcessFaceQueue()
+    set_transport(transport)
+    monkeypatch.setattr(face_queue, "FACE_QUEUE_CLAIM_TIMEOUT", 0.2)
+    monkeypatch.setattr(face_queue, "FACE_QUEUE_RESULT_TIMEOUT", 0.2)
+    # Local fallbacks never reach dlib in these tests.
+    monkeypatch.setattr(face_queue, "execute_job", lambda kind, payload, options=None: {"result": "local"})
+    yield transport
+    set_transport(None)
+
+
+async def with_worker(transport, coroutine):
+    """Run a coroutine while a face worker with a thread executor serves the queue."""
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        worker = asyncio.create_task(face_worker.run_worker(transport, concurrency=2, executor=executor))
+        try:
+            return await coroutine
+        finally:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+
+
+def counter(name):
+    return metrics.snapshot().get(name, 0)
+
+
+def test_worker_result_is_returned(in_process_queue, monkeypatch):
+    monkeypatch.setattr(face_worker, "execute_job", lambda kind, payload, options=None: {"result": ENCODING})
+    completed = counter("face_queue.completed")
+
+    result = asyncio.run(with_worker(in_process_queue, run_face_job("encode", b"image")))
+
+    assert result == ENCODING
+    assert counter("face_queue.completed") == completed + 1
+
+
+def test_falls_back_locally_when_no_worker_claims():
+    fallbacks = counter("face_queue.local_fallbacks")
+
+    result = asyncio.run(run_face_job("encode", b"image"))
+
+    assert result == "local"
+    assert counter("face_queue.local_fallbacks") == fallbacks + 1
+
+
+def test_falls_back_locally_when_worker_times_out(in_process_queue):
+    async def claim_and_stall():
+        stalled = asyncio.create_task(in_process_queue.claim("stalled-worker", 1))
+        result = await run_face_job("encode", b"image")
+        assert (await stalled)["status"] == "running"
+        return result
+
+    timeouts = counter("face_queue.timeouts")
+
+    assert asyncio.run(claim_and_stall()) == "local"
+    assert counter("face_queue.timeouts") == timeouts + 1
+
+
+def test_worker_error_maps_to_http_exception(in_process_queue, monkeypatch):
+    error = {"error": {"status_code": 400, "detail": "No face detected in the image"}}
+    monkeypatch.setattr(face_worker, "execute_job", lambda kind, payload, options=None: error)
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(with_worker(in_process_queue, run_face_job("encode", b"image")))
+
+    assert raised.value.status_code == 400
+    assert raised.value.detail == "No face detected in the image"
+
+
+def test_worker_quality_rejection_maps_to_image_quality_error(in_process_queue, monkeypatch):
+    rejection = ImageQualityError("too_dark", "Image is too dark. Move to a brighter spot.")
+    error = {"error": {"status_code": 400, "detail": rejection.detail, "quality_code": "too_dark"}}
+    monkeypatch.setattr(face_worker, "execute_job", lambda kind, payload, options=None: error)
+
+    with pytest.raises(ImageQualityError) as raised:
+        asyncio.run(with_worker(in_process_queue, run_face_job("encode", b"image")))
+
+    assert raised.value.code == "too_dark"
+    assert raised.value.detail == rejection.detail
+
+
+def test_worker_failure_fails_the_job_instead_of_leaving_it_running(in_process_queue, monkeypatch):
+    def crash(kind, payload, options=None):
+        raise RuntimeError("model crashed")
+
+    monkeypatch.setattr(face_worker, "execute_job", crash)
+    errors = counter("face_worker.errors")
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(with_worker(in_process_queue, run_face_job("encode", b"image")))
+
+    assert raised.value.status_code == 503
+    assert "model crashed" in raised.value.detail
+    assert counter("face_worker.errors") == errors + 1
+
+
+def test_worker_survives_transport_errors(in_process_queue, monkeypatch):
+    monkeypatch.setattr(face_worker, "execute_job", lambda kind, payload, options=None: {"result": ENCODING})
+    monkeypatch.setattr(face_worker, "CLAIM_POLL_SECONDS", 0.01)
+    claim = in_process_queue.claim
+    failures = []
+
+    async def flaky_claim(worker_id, timeout):
+        if not failures:
+            failures.append(worker_id)
+            raise ConnectionError("Mongo hiccup")
+        return await claim(worker_id, timeout)
+
+    monkeypatch.setattr(in_process_queue, "claim", flaky_claim)
+
+    result = asyncio.run(with_worker(in_process_queue, run_face_job("encode", b"image")))
+
+    assert result == ENCODING
+    assert failures
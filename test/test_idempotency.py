@@ -0,0 +1,133 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+import idempotency
+from idempotency import run_idempotent
+
+
+class FakeKeys:
+    """The handful of idempotency_keys operations run_idempotent uses, kept in a dict."""
+
+    def __init__(self):
+        self.records = {}
+
+    async def insert_one(self, document):
+        if document["_id"] in self.records:
+            raise DuplicateKeyError("E11000 duplicate key")
+        self.records[document["_id"]] = dict(document)
+
+    async def find_one_and_update(self, query, update):
+        record = self.records.get(query["_id"])
+        if record and record["status"] == query["status"] and record["created_at"] < query["created_at"]["$lt"]:
+            before = dict(record)
+            record.update(update["$set"])
+            return before
+        return None
+
+    async def find_one(self, query):
+        return self.records.get(query["_id"])
+
+    async def update_one(self, query, update):
+        self.records[query["_id"]].update(update["$set"])
+
+    async def delete_one(self, query):
+        record = self.records.get(query["_id"])
+        if record and record["status"] == query["status"]:
+            del self.records[query["_id"]]
+
+
+@pytest.fixture(autouse=True)
+def keys(monkeypatch):
+    keys = FakeKeys()
+    monkeypatch.setattr(idempotency, "idempotency_keys_collection", keys)
+    monkeypatch.setattr(idempotency, "_cache", OrderedDict())
+    monkeypatch.setattr(idempotency, "POLL_INTERVAL_SECONDS", 0.01)
+    return keys
+
+
+class Handler:
+    def __init__(self, delay=0, error=None):
+        self.calls = 0
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {"message": "Check-in successful", "call": self.calls}
+
+
+def test_retry_replays_first_response(keys):
+    handler = Handler()
+
+    async def scenario():
+        first = await run_idempotent("key", handler)
+        replay = await run_idempotent("key", handler)
+        return first, replay
+
+    first, replay = asyncio.run(scenario())
+    assert first == {"message": "Check-in successful", "call": 1}
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.body == b'{"message":"Check-in successful","call":1}'
+    assert handler.calls == 1
+    assert keys.records["key"]["status"] == "completed"
+
+
+def test_replays_from_store_when_another_worker_completed_the_key(keys, monkeypatch):
+    handler = Handler()
+    asyncio.run(run_idempotent("key", handler))
+    # A different worker has an empty front cache.
+    monkeypatch.setattr(idempotency, "_cache", OrderedDict())
+
+    replay = asyncio.run(run_idempotent("key", handler))
+
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert handler.calls == 1
+
+
+def test_concurrent_requests_with_one_key_run_once():
+    handler = Handler(delay=0.05)
+
+    async def scenario():
+        return await asyncio.gather(run_idempotent("key", handler), run_idempotent("key", handler))
+
+    first, second = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert first == {"message": "Check-in successful", "call": 1}
+    assert second.headers["Idempotent-Replayed"] == "true"
+
+
+def test_failure_releases_the_key(keys):
+    failing = Handler(error=HTTPException(status_code=401, detail="Face not recognized"))
+    with pytest.raises(HTTPException):
+        asyncio.run(run_idempotent("key", failing))
+    assert "key" not in keys.records
+
+    handler = Handler()
+    assert asyncio.run(run_idempotent("key", handler)) == {"message": "Check-in successful", "call": 1}
+
+
+def test_stale_pending_key_is_taken_over(keys):
+    stale = datetime.utcnow() - timedelta(seconds=idempotency.IN_FLIGHT_TIMEOUT_SECONDS + 1)
+    keys.records["key"] = {"_id": "key", "status": "pending", "created_at": stale}
+    handler = Handler()
+
+    assert asyncio.run(run_idempotent("key", handler)) == {"message": "Check-in successful", "call": 1}
+    assert handler.calls == 1
+
+
+def test_fresh_pending_key_elsewhere_is_a_conflict(keys, monkeypatch):
+    # Claimed just now by another worker, which keeps it from going stale during the test.
+    keys.records["key"] = {"_id": "key", "status": "pending", "created_at": datetime.utcnow() + timedelta(minutes=1)}
+    monkeypatch.setattr(idempotency, "IN_FLIGHT_TIMEOUT_SECONDS", 0.05)
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(run_idempotent("key", Handler()))
+    assert raised.value.status_code == 409
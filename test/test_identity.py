@@ -0,0 +1,91 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+from bson import ObjectId
+
+import identity
+from identity import lookup_identity
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = {}
+        self.reads = 0
+
+    async def find_one(self, query, projection=None, max_time_ms=None):
+        self.reads += 1
+        key, value = next(iter(query.items()))
+        return next((doc for doc in self.documents.values() if doc.get(key) == value), None)
+
+
+@pytest.fixture(autouse=True)
+def collections(monkeypatch):
+    fakes = {"users_by_email": FakeCollection(), "employers": FakeCollection(), "employees": FakeCollection()}
+    monkeypatch.setattr(identity, "users_by_email_collection", fakes["users_by_email"])
+    monkeypatch.setattr(identity, "employers_collection", fakes["employers"])
+    monkeypatch.setattr(identity, "employees_collection", fakes["employees"])
+    monkeypatch.setattr(identity, "_unknown_emails", OrderedDict())
+
+    async def register_identities(user_type, users):
+        for user in users:
+            fakes["users_by_email"].documents[user["email"]] = {
+                "_id": user["email"], "user_type": user_type, "user_id": str(user["_id"]),
+                "username": user["username"], "password": user["password"],
+            }
+
+    monkeypatch.setattr(identity, "register_identities", register_identities)
+    return fakes
+
+
+def register_elsewhere(collections, email):
+    """A registration handled by another worker: the index is written, this cache is untouched."""
+    collections["users_by_email"].documents[email] = {
+        "_id": email, "user_type": "employee", "user_id": str(ObjectId()), "username": "new", "password": "hash",
+    }
+
+
+def test_login_right_after_registering_on_another_worker(collections):
+    assert asyncio.run(lookup_identity("new@example.com")) is None
+    register_elsewhere(collections, "new@example.com")
+
+    identity_entry = asyncio.run(lookup_identity("new@example.com"))
+
+    assert identity_entry["username"] == "new"
+
+
+def test_repeated_misses_are_cached(collections):
+    for _ in range(2):
+        assert asyncio.run(lookup_identity("ghost@example.com")) is None
+    reads = collections["users_by_email"].reads
+
+    assert asyncio.run(lookup_identity("ghost@example.com")) is None
+    assert collections["users_by_email"].reads == reads
+
+
+def test_cached_misses_expire(collections, monkeypatch):
+    for _ in range(2):
+        asyncio.run(lookup_identity("late@example.com"))
+    register_elsewhere(collections, "late@example.com")
+    monkeypatch.setattr(identity.time, "monotonic", lambda: float("inf"))
+
+    assert asyncio.run(lookup_identity("late@example.com"))["username"] == "new"
+
+
+def test_miss_is_one_indexed_read_once_backfilled(collections, monkeypatch):
+    monkeypatch.setattr(identity, "IDENTITY_LEGACY_FALLBACK", False)
+
+    assert asyncio.run(lookup_identity("nobody@example.com")) is None
+    assert collections["users_by_email"].reads == 1
+    assert collections["employers"].reads == collections["employees"].reads == 0
+
+
+def test_legacy_account_is_found_and_written_back_before_backfill(collections, monkeypatch):
+    monkeypatch.setattr(identity, "IDENTITY_LEGACY_FALLBACK", True)
+    employee_id = ObjectId()
+    collections["employees"].documents[employee_id] = {
+        "_id": employee_id, "email": "old@example.com", "username": "old", "password": "hash",
+    }
+
+    assert asyncio.run(lookup_identity("old@example.com"))["user_id"] == str(employee_id)
+    assert collections["users_by_email"].documents["old@example.com"]["user_type"] == "employee"
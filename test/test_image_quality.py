@@ -0,0 +1,61 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import utils
+from utils import ImageQualityError, check_image_quality
+
+
+@pytest.fixture(autouse=True)
+def pillow_only(monkeypatch):
+    # The quality gate only needs PIL; skip loading the dlib models.
+    monkeypatch.setattr(utils, "face_backend", lambda: (None, Image))
+
+
+def encode(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8), "L").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def textured(size=300, low=60, high=200):
+    return np.random.default_rng(0).integers(low, high, (size, size))
+
+
+def rejection_code(image_bytes, **kwargs):
+    with pytest.raises(ImageQualityError) as raised:
+        check_image_quality(image_bytes, **kwargs)
+    assert raised.value.status_code == 400
+    return raised.value.code
+
+
+def test_accepts_well_exposed_sharp_image():
+    check_image_quality(encode(textured()))
+
+
+def test_rejects_small_image():
+    assert rejection_code(encode(textured(size=80))) == "too_small"
+
+
+def test_chips_skip_the_size_check():
+    check_image_quality(encode(textured(size=80)), check_size=False)
+
+
+def test_rejects_dark_image():
+    assert rejection_code(encode(textured(low=0, high=30))) == "too_dark"
+
+
+def test_rejects_bright_image():
+    assert rejection_code(encode(textured(low=230, high=256))) == "too_bright"
+
+
+def test_rejects_clipped_image():
+    pixels = np.zeros((300, 300))
+    pixels[:, 150:] = 255
+    assert rejection_code(encode(pixels)) == "poor_exposure"
+
+
+def test_rejects_blurry_image():
+    assert rejection_code(encode(np.full((300, 300), 128))) == "too_blurry"
@@ -0,0 +1,116 @@
+import io
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import onboarding
+from auth import get_current_user
+from onboarding import iter_archive
+from routes.employer import face_router
+
+DETAILS = (
+    "username,email,password,hourly_rate,photo\n"
+    "alice,alice@example.com,secret,20,photos/alice.jpg\n"
+    "bob,bob@example.com,secret,not-a-number,photos/bob.jpg\n"
+    "carol,carol@example.com,secret,18,photos/missing.jpg\n"
+)
+
+
+class FakeEmployees:
+    def __init__(self):
+        self.documents = []
+
+    async def _iterate(self, documents):
+        for document in documents:
+            yield document
+
+    def find(self, query, projection=None):
+        emails = set(query["email"]["$in"])
+        return self._iterate([document for document in self.documents if document["email"] in emails])
+
+    async def insert_many(self, documents, ordered=True):
+        for document in documents:
+            document["_id"] = ObjectId()
+            self.documents.append(document)
+
+
+@pytest.fixture
+def employees(monkeypatch):
+    employees = FakeEmployees()
+    registered = []
+
+    async def register_identities(user_type, users):
+        registered.extend(users)
+
+    monkeypatch.setattr(onboarding, "employees_collection", employees)
+    monkeypatch.setattr(onboarding, "register_identities", register_identities)
+    # Threads instead of processes, and no dlib: every photo encodes to the same vector.
+    monkeypatch.setattr(onboarding, "_new_executor", lambda: ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(onboarding, "prepare_employee",
+                        lambda image_bytes, password: {"result": [0.1] * 128, "password": "hashed"})
+    return employees
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(face_router, prefix="/employer")
+    app.dependency_overrides[get_current_user] = lambda: {"id": "employer-1", "type": "employer"}
+    return TestClient(app)
+
+
+def photo_archive():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("photos/alice.jpg", b"alice")
+        archive.writestr("photos/bob.jpg", b"bob")
+    return buffer.getvalue()
+
+
+def test_bulk_upload_of_csv_and_zip(client, employees):
+    response = client.post("/employer/employees/bulk", files={
+        "details": ("details.csv", DETAILS.encode("utf-8-sig"), "text/csv"),
+        "archive": ("photos.zip", photo_archive(), "application/zip"),
+    })
+
+    assert response.status_code == 200
+    report = response.json()["report"]
+    assert [(entry["row"], entry["status"]) for entry in report] == [(1, "created"), (2, "invalid"), (3, "invalid")]
+    assert report[2]["detail"] == "Photo photos/missing.jpg not found in archive"
+
+    [alice] = employees.documents
+    assert alice["email"] == "alice@example.com"
+    assert alice["employer_id"] == "employer-1"
+    assert alice["password"] == "hashed"
+
+
+def test_bulk_upload_rejects_undecodable_csv(client, employees):
+    response = client.post("/employer/employees/bulk", files={
+        "details": ("details.csv", b"\xff\xfe\x00bad", "text/csv"),
+        "archive": ("photos.zip", photo_archive(), "application/zip"),
+    })
+
+    assert response.status_code == 400
+
+
+class Py310SpooledFile(tempfile.SpooledTemporaryFile):
+    """Starlette's upload file as Python 3.10 has it: no seekable() or readable()."""
+
+    def __getattribute__(self, name):
+        if name in ("seekable", "readable"):
+            raise AttributeError(name)
+        return super().__getattribute__(name)
+
+
+@pytest.mark.parametrize("max_size", [1024 * 1024, 16], ids=["in-memory", "rolled-over"])
+def test_zip_in_spooled_upload_without_seekable(max_size):
+    upload = Py310SpooledFile(max_size=max_size)
+    upload.write(photo_archive())
+    upload.seek(0)
+
+    assert dict(iter_archive(upload, "photos.zip")) == {"photos/alice.jpg": b"alice", "photos/bob.jpg": b"bob"}
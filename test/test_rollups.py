@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from rollups import split_session_by_day, rollup_operations
+
+
+def buckets(operations):
+    return {operation._filter["bucket"]: operation._doc["$inc"] for operation in operations}
+
+
+def test_split_session_across_midnight():
+    slices = split_session_by_day(datetime(2026, 3, 10, 22, 0), datetime(2026, 3, 11, 2, 30))
+    assert slices == [(datetime(2026, 3, 10, 22, 0), 2.0), (datetime(2026, 3, 11, 0, 0), 2.5)]
+
+
+def test_split_session_within_one_day():
+    slices = split_session_by_day(datetime(2026, 3, 10, 9, 0), datetime(2026, 3, 10, 17, 0))
+    assert slices == [(datetime(2026, 3, 10, 9, 0), 8.0)]
+
+
+def test_midnight_shift_splits_hours_and_earnings_between_days():
+    session = {"check_in": datetime(2026, 3, 10, 22, 0), "check_out": datetime(2026, 3, 11, 2, 0), "earnings": 80.0}
+    totals = buckets(rollup_operations("employer", "employee", session))
+
+    assert totals["day:2026-03-10"] == {"hours_worked": 2.0, "earnings": 40.0, "sessions": 1}
+    assert totals["day:2026-03-11"] == {"hours_worked": 2.0, "earnings": 40.0, "sessions": 0}
+    # Both days fall in the same ISO week and month.
+    assert totals["week:2026-W11"] == {"hours_worked": 4.0, "earnings": 80.0, "sessions": 1}
+    assert totals["month:2026-03"] == {"hours_worked": 4.0, "earnings": 80.0, "sessions": 1}
+
+
+def test_shift_crossing_iso_week_and_year_boundary():
+    # Sunday 3 Jan 2027 closes ISO week 2026-W53; Monday 4 Jan opens 2027-W01.
+    session = {"check_in": datetime(2027, 1, 3, 20, 0), "check_out": datetime(2027, 1, 4, 4, 0), "earnings": 160.0}
+    totals = buckets(rollup_operations("employer", "employee", session))
+
+    assert totals["week:2026-W53"] == {"hours_worked": 4.0, "earnings": 80.0, "sessions": 1}
+    assert totals["week:2027-W01"] == {"hours_worked": 4.0, "earnings": 80.0, "sessions": 0}
+    assert totals["month:2027-01"] == {"hours_worked": 8.0, "earnings": 160.0, "sessions": 1}
+
+
+def test_week_bucket_starts_on_monday():
+    session = {"check_in": datetime(2027, 1, 3, 20, 0), "check_out": datetime(2027, 1, 4, 4, 0), "earnings": 0}
+    starts = {
+        operation._filter["bucket"]: operation._doc["$setOnInsert"]["bucket_start"]
+        for operation in rollup_operations("employer", "employee", session)
+    }
+    assert starts["week:2026-W53"] == datetime(2026, 12, 28)
+    assert starts["week:2027-W01"] == datetime(2027, 1, 4)
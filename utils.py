@@ -1,11 +1,24 @@
-import cv2
+import os
 import numpy as np
-import face_recognition
+from functools import lru_cache
 from fastapi import HTTPException
 from passlib.context import CryptContext  # For password hashing
-from PIL import Image
 from io import BytesIO
 
+# Image quality gate thresholds (set any to 0 to disable that check)
+FACE_MIN_WIDTH = int(os.getenv("FACE_MIN_WIDTH", "120"))
+FACE_MIN_HEIGHT = int(os.getenv("FACE_MIN_HEIGHT", "120"))
+FACE_MIN_SHARPNESS = float(os.getenv("FACE_MIN_SHARPNESS", "40"))
+FACE_MIN_BRIGHTNESS = float(os.getenv("FACE_MIN_BRIGHTNESS", "40"))
+FACE_MAX_BRIGHTNESS = float(os.getenv("FACE_MAX_BRIGHTNESS", "220"))
+FACE_MAX_CLIPPED_FRACTION = float(os.getenv("FACE_MAX_CLIPPED_FRACTION", "0.6"))
+QUALITY_PROBE_SIZE = 256
+
+# Pre-cropped, aligned face chips sent by clients that run detection on-device
+FACE_CHIP_MIN_SIZE = int(os.getenv("FACE_CHIP_MIN_SIZE", "100"))
+FACE_CHIP_MAX_SIZE = int(os.getenv("FACE_CHIP_MAX_SIZE", "320"))
+FACE_CHIP_MAX_BYTES = int(os.getenv("FACE_CHIP_MAX_BYTES", str(256 * 1024)))
+
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -17,9 +30,71 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain text password against a hashed one."""
     return pwd_context.verify(plain_password, hashed_password)
 
+@lru_cache(maxsize=None)
+def face_backend():
+    """Import the face stack (dlib models, PIL) on first use instead of at startup.
+
+    Workers that never touch a face route never pay for loading it.
+    """
+    import face_recognition
+    from PIL import Image
+    return face_recognition, Image
+
+def warm_up_face_backend():
+    """Load the face models up front on workers that will serve face routes."""
+    face_backend()
+
+class ImageQualityError(HTTPException):
+    """Upload rejected by the quality gate; ``code`` tells the client what to fix."""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(status_code=400, detail={"code": code, "message": message})
+        self.code = code
+
+def check_image_quality(image_bytes: bytes, check_size: bool = True):
+    """Reject tiny, blurry or badly exposed images before paying for face detection.
+
+    Works on a small grayscale copy; for JPEGs the decoder itself downsamples.
+    """
+    _, Image = face_backend()
+    probe = Image.open(BytesIO(image_bytes))
+    width, height = probe.size
+    if check_size and (width < FACE_MIN_WIDTH or height < FACE_MIN_HEIGHT):
+        raise ImageQualityError(
+            "too_small",
+            f"Image is {width}x{height}; at least {FACE_MIN_WIDTH}x{FACE_MIN_HEIGHT} is required."
+        )
+
+    probe.draft("L", (QUALITY_PROBE_SIZE, QUALITY_PROBE_SIZE))
+    gray = probe.convert("L")
+    gray.thumbnail((QUALITY_PROBE_SIZE, QUALITY_PROBE_SIZE))
+    pixels = np.asarray(gray, dtype=np.float32)
+
+    brightness = pixels.mean()
+    if brightness < FACE_MIN_BRIGHTNESS:
+        raise ImageQualityError("too_dark", "Image is too dark. Move to a brighter spot.")
+    if FACE_MAX_BRIGHTNESS and brightness > FACE_MAX_BRIGHTNESS:
+        raise ImageQualityError("too_bright", "Image is overexposed. Avoid direct light behind or on the camera.")
+
+    histogram = np.bincount(pixels.astype(np.uint8).ravel(), minlength=256)
+    clipped = (histogram[:6].sum() + histogram[250:].sum()) / pixels.size
+    if FACE_MAX_CLIPPED_FRACTION and clipped > FACE_MAX_CLIPPED_FRACTION:
+        raise ImageQualityError("poor_exposure", "Image has too much pure black or white. Even out the lighting.")
+
+    # Variance of the 4-neighbour Laplacian: low values mean few edges, i.e. blur.
+    laplacian = (
+        pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1]
+        - 4 * pixels[1:-1, 1:-1]
+    )
+    if laplacian.var() < FACE_MIN_SHARPNESS:
+        raise ImageQualityError("too_blurry", "Image is blurry. Hold the camera still and focus on the face.")
+
 def get_face_encoding(image_bytes: bytes):
     """Extract face encoding from an uploaded image."""
+    face_recognition, Image = face_backend()
     try:
+        check_image_quality(image_bytes)
+
         # Open image safely
         image = Image.open(BytesIO(image_bytes)).convert('RGB')
 
@@ -41,11 +116,60 @@ def get_face_encoding(image_bytes: bytes):
 
         return face_encodings[0].tolist()  # Return as list (MongoDB-friendly)
 
+    except ImageQualityError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Image processing error: {str(e)}")
+
+def validate_chip_landmarks(landmarks, width: int, height: int):
+    """Check client landmarks are a list of [x, y] points that lie inside the chip."""
+    if not isinstance(landmarks, list) or len(landmarks) not in (5, 68):
+        raise ImageQualityError("invalid_chip", "Landmarks must be a list of 5 or 68 [x, y] points.")
+    for point in landmarks:
+        if (not isinstance(point, (list, tuple)) or len(point) != 2
+                or not (0 <= point[0] < width and 0 <= point[1] < height)):
+            raise ImageQualityError("invalid_chip", "Landmarks must lie inside the face chip.")
+
+def get_chip_encoding(chip_bytes: bytes, landmarks=None):
+    """Encode a pre-cropped, aligned face chip without running face detection.
+
+    The whole chip is treated as the face box, so only the landmark fit and the
+    embedding network run on the server.
+    """
+    face_recognition, Image = face_backend()
+    try:
+        if len(chip_bytes) > FACE_CHIP_MAX_BYTES:
+            raise ImageQualityError("invalid_chip", f"Face chip must be at most {FACE_CHIP_MAX_BYTES} bytes.")
+
+        image = Image.open(BytesIO(chip_bytes)).convert('RGB')
+        width, height = image.size
+        if not (FACE_CHIP_MIN_SIZE <= min(width, height) and max(width, height) <= FACE_CHIP_MAX_SIZE):
+            raise ImageQualityError(
+                "invalid_chip",
+                f"Face chip must be between {FACE_CHIP_MIN_SIZE} and {FACE_CHIP_MAX_SIZE} pixels per side."
+            )
+        if abs(width - height) > 0.1 * max(width, height):
+            raise ImageQualityError("invalid_chip", "Face chip must be square.")
+        if landmarks is not None:
+            validate_chip_landmarks(landmarks, width, height)
+
+        check_image_quality(chip_bytes, check_size=False)
+
+        np_image = np.array(image)
+        face_encodings = face_recognition.face_encodings(np_image, known_face_locations=[(0, width, height, 0)])
+        if not face_encodings:
+            raise HTTPException(status_code=400, detail="Face chip encoding failed.")
+
+        return face_encodings[0].tolist()
+
+    except ImageQualityError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Image processing error: {str(e)}")
 
 def compare_faces(known_encodings, unknown_encoding, tolerance: float = 0.6):
     """Compare an unknown face encoding with known ones."""
+    face_recognition, _ = face_backend()
     try:
         known_encodings = [np.array(encoding, dtype=np.float64) for encoding in known_encodings]
         unknown_encoding = np.array(unknown_encoding, dtype=np.float64)